@@ -119,11 +119,18 @@ man page.
 '''
 import re
 import os
+import io
 import sys
+import json
+import hashlib
 import subprocess
 import tempfile
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 import fwalktree
+import txtid
+import runstats
+import fupdate
 
 C_MARKER = '#$'
 RE_SIMPLE = re.compile(r'^\s*#\$ ?')
@@ -143,10 +150,23 @@ O_Q = False
 '''quiet flag - do not show what is being done'''
 O_V = False
 '''verbose flag - show additional info (i.e. things that re not being done)'''
-O_IDS = {}
+O_IDS = txtid.defines
+'''text file id values defined with `-D` (shared with `txtid`)'''
+O_OBJHDR = '## Definitions'
+'''header added before the first object definition (`--header`)'''
+O_PREFIX = '###'
+'''markdown heading prefix for object definitions (`--obj-heading`)'''
 
 
 O_MANIFY = None
+MANIFEST = None
+'''Incremental build manifest, None if not enabled (See `load_manifest`)'''
+DEF_MANIFEST = '.ashdoc-manifest.json'
+'''Default build manifest file name, kept in the output directory'''
+MANIFEST_VERSION = 1
+'''Version of the build manifest format'''
+ENV_ASHDOC_STATS = 'ASHDOC_STATS'
+'''Environment variable name used for enabling run statistics (See `--stats`)'''
 RE_MANIFY = re.compile(r'\.[1-8]\.md$')
 RE_MANIFY_VER = re.compile(r'\n:version:[ \t]*([^\n]*)\n')
 RE_MANIFY_MUNGE = re.compile(r'\n([ \t]*)(#+[ \t]+[^\n]+)\n')
@@ -157,13 +177,13 @@ def update_file(fpath, ntxt, dryrun=True):
   :param str fpath: File to write
   :param str ntxt: New file contents
   :param bool dryrun: if True, only inform what would happen.
+
+  The existing file is compared without reading it whole, and it
+  is replaced atomically (See `fupdate`).
   '''
-  if os.path.isfile(fpath):
-    with open(fpath,'r') as fp:
-      otxt = fp.read()
-    if ntxt == otxt:
-      if O_V: sys.stderr.write('{fname}: no changes found\n'.format(fname=fpath))
-      return
+  if fupdate.same_text(fpath, ntxt):
+    if O_V: sys.stderr.write('{fname}: no changes found\n'.format(fname=fpath))
+    return
 
   # Make sure the directory exists
   dname = os.path.dirname(fpath)
@@ -173,8 +193,9 @@ def update_file(fpath, ntxt, dryrun=True):
   if dryrun:
     if not O_Q: sys.stderr.write('{fname}: WONT update\n'.format(fname=fpath))
   else:
-    with open(fpath,'w') as fp:
-      fp.write(ntxt)
+    fupdate.write_text(fpath, ntxt)
+    runstats.count('files_rewritten')
+    runstats.count('bytes_written', len(ntxt))
     if not O_Q: sys.stderr.write('{fname}: updated\n'.format(fname=fpath))
 
 
@@ -217,31 +238,378 @@ def process_file(f, output, toc=[], dryrun=True, apigen='', gdocgen=None):
   :param str dryrun: If not None, will not make changes to files
   :param str apigen: If not None, generate API documentation
   :param str gdocgen: If not None, generate generic documentation
+
+  With a build manifest, unchanged files are skipped (See `up_to_date`).
   '''
+  if not MANIFEST is None:
+    docs = up_to_date(f, output)
+    if not docs is None:
+      toc.extend(docs)
+      return
+  ids = {}
+  srec = []
+  content = extract_file(f, apigen, gdocgen, ids, srec)
+  write_content(f, content, output, toc, dryrun)
+  record_source(f, srec, content, ids, output, dryrun)
+
+def extract_file(f, apigen='', gdocgen=None, ids=None, source=None):
+  '''Extract the documentation of a file
 
+  :param str f: file to process
+  :param str apigen: If not None, generate API documentation
+  :param str gdocgen: If not None, generate generic documentation
+  :param dict|None ids: (Optional) receives the text file id values used
+  :param list|None source: (Optional) receives the record of the contents read (See `extract_docstr`)
+  :returns dict: generated content, by document path relative to the output directory
+  '''
   if f.endswith('.sh'):
     basename = f[:-3]
   elif f.endswith('.bash'):
     basename = f[:-3]
   else:
     basename = f
-  of= '{dirpath}/{basename}.md'.format(dirpath=output.rstrip('/'),basename=basename)
 
-  if output != '': output = output.rstrip('/') + '/'
   if not apigen is None and apigen != '': apigen = apigen.rstrip('/') + '/'
   if not gdocgen is None and gdocgen != '': gdocgen = gdocgen.rstrip('/') + '/'
 
   content = {}
-  cnt = extract_docstr(f, basename, content, apigen, gdocgen)
-  if cnt == 0:
+  extract_docstr(f, basename, content, apigen, gdocgen, ids, source)
+  return content
+
+def write_content(f, content, output, toc=[], dryrun=True):
+  '''Write the documentation extracted from a file
+
+  :param str f: file the documentation was extracted from
+  :param dict content: generated content from `extract_file`
+  :param str output: output directory
+  :param list toc: list to received generated files
+  :param str dryrun: If not None, will not make changes to files
+  '''
+  if len(content) == 0:
     if O_V: sys.stderr.write('{fname}: no embedded documentation found (ignoring)\n'.format(fname=f))
     return
 
+  if output != '': output = output.rstrip('/') + '/'
   for doc in content:
     toc.append(doc)
     update_file(output + doc, content[doc], dryrun)
 
-def extract_docstr(f, basename, content = {}, apigen='', gdocgen=None):
+def init_worker(ids, manify, objhdr, prefix, quiet, verbose, fwcf, stats):
+  '''Initialize an extraction worker process
+
+  :param dict ids: text file id values defined with `-D`
+  :param str|None manify: manify mode
+  :param str objhdr: object definitions header
+  :param str prefix: object definitions heading prefix
+  :param bool quiet: quiet flag
+  :param bool verbose: verbose flag
+  :param dict fwcf: fwalktree configuration
+  :param bool stats: True if run statistics are enabled
+  '''
+  global O_MANIFY, O_OBJHDR, O_PREFIX, O_Q, O_V
+  O_IDS.update(ids)
+  O_MANIFY = manify
+  O_OBJHDR = objhdr
+  O_PREFIX = prefix
+  O_Q = quiet
+  O_V = verbose
+  fwalktree.cf.update(fwcf)
+  if stats:
+    enable_stats()
+    runstats.take() # Drop statistics inherited from the parent
+
+def extract_job(f, apigen, gdocgen, explicit = False):
+  '''Extract the documentation of a file capturing its error output
+
+  :param str f: file to process
+  :param str apigen: If not None, generate API documentation
+  :param str gdocgen: If not None, generate generic documentation
+  :param bool explicit: (Optional) True if `f` was named explicitly, False if it was found walking a directory
+  :returns tuple: (dict content, str stderr text, dict ids, list|None source record, Exception|None error, dict|None stats)
+
+  Runs `extract_file` with `sys.stderr` redirected to a buffer, so that
+  the parent can report messages in the same order files were
+  submitted.  Errors in files found walking a directory are reported
+  as `fwalktree.walktree` does.  Errors in explicitly named files are
+  returned, so that the parent raises them as when processing files
+  one by one.  The text file ids used and the record of the contents
+  read are returned for the build manifest (See `record_source`).
+  '''
+  stderr = sys.stderr
+  sys.stderr = io.StringIO()
+  content = {}
+  ids = {}
+  srec = []
+  error = None
+  try:
+    content = extract_file(f, apigen, gdocgen, ids, srec)
+  except Exception as err:
+    if explicit:
+      error = err
+    else:
+      fwalktree.report_error(f, err)
+    srec = None
+  finally:
+    txt = sys.stderr.getvalue()
+    sys.stderr = stderr
+  return (content, txt, ids, srec, error, runstats.take() if runstats.enabled else None)
+
+def process_files(files, jobs, output, toc=[], dryrun=True, apigen='', gdocgen=None, explicit=()):
+  '''Process files using a process pool
+
+  :param list files: list of str with files to process
+  :param int jobs: number of worker processes
+  :param str output: output directory
+  :param list toc: list to received generated files
+  :param str dryrun: If not None, will not make changes to files
+  :param str apigen: If not None, generate API documentation
+  :param str gdocgen: If not None, generate generic documentation
+  :param set explicit: (Optional) files in `files` that were named explicitly (See `extract_job`)
+
+  Documentation is extracted in parallel.  Generated content is
+  written by the parent, in the order of `files`, so that messages,
+  errors and the TOC are the same as when processing files one by one.
+  With a build manifest, unchanged files are not submitted.
+  '''
+  skipped = {}
+  if not MANIFEST is None:
+    for f in files:
+      docs = up_to_date(f, output)
+      if not docs is None: skipped[f] = docs
+  pending = [ f for f in files if not f in skipped ]
+  if len(pending) == 0:
+    for f in files: toc.extend(skipped[f])
+    return
+
+  chunksize = max(1, len(pending) // (jobs * 4))
+  with ProcessPoolExecutor(max_workers=jobs,
+                           initializer=init_worker,
+                           initargs=(dict(O_IDS), O_MANIFY, O_OBJHDR, O_PREFIX,
+                                     O_Q, O_V, fwalktree.cf, runstats.enabled)) as pool:
+    results = pool.map(extract_job, pending,
+                       [apigen] * len(pending), [gdocgen] * len(pending),
+                       [ f in explicit for f in pending ],
+                       chunksize=chunksize)
+    for f in files:
+      if f in skipped:
+        toc.extend(skipped[f])
+        continue
+      content, txt, ids, srec, error, stats = next(results)
+      sys.stderr.write(txt)
+      if not stats is None: runstats.merge(stats)
+      if not error is None: raise error
+      write_content(f, content, output, toc, dryrun)
+      record_source(f, srec, content, ids, output, dryrun)
+
+def text_hash(txt):
+  '''Compute the hash of a string
+
+  :param str|bytes txt: text to hash
+  :returns str: hex digest
+  '''
+  if isinstance(txt, str): txt = txt.encode()
+  return hashlib.sha256(txt).hexdigest()
+
+def file_sig(f):
+  '''Get the signature of a file
+
+  :param str f: file path
+  :returns tuple|None: `(mtime_ns, size)`, None if `f` does not exist
+  '''
+  try:
+    st = os.stat(f)
+  except OSError:
+    return None
+  return (st.st_mtime_ns, st.st_size)
+
+def same_file(f, rec):
+  '''Check if a file matches a manifest record
+
+  :param str f: file path
+  :param list rec: `[mtime_ns, size, hash]` as recorded in the manifest
+  :returns bool: True if the file was not modified
+
+  Files with the same signature are assumed unchanged without reading
+  them.  Otherwise the contents hash is compared, and the record is
+  updated if they are the same.
+  '''
+  sig = file_sig(f)
+  if sig is None: return False
+  if list(sig) == rec[:2]: return True
+  try:
+    with open(f,'rb') as fp:
+      if text_hash(fp.read()) != rec[2]: return False
+  except OSError:
+    return False
+  rec[:2] = sig
+  MANIFEST['changed'] = True
+  return True
+
+def id_value(sndir, idpath):
+  '''Look-up a text file id as `extract_docstr` does
+
+  :param str sndir: directory of the source file, with a trailing `/` (or empty)
+  :param str idpath: text file id path
+  :returns str|None: text file id value, None if not found or empty
+  '''
+  txid = txtid.read_id(sndir + idpath)
+  if txid is None and not os.path.isfile(sndir + idpath): return O_IDS.get(idpath)
+  return txid
+
+def up_to_date(f, output):
+  '''Check if a file needs to be processed again
+
+  :param str f: file to process
+  :param str output: output directory
+  :returns list|None: documents generated from `f` if it did not change, otherwise None
+
+  A file is up to date if its contents, the values of the text file
+  ids (and `-D` definitions) it used, and the documents generated
+  from it did not change since they were recorded in the build
+  manifest.
+  '''
+  key = os.path.abspath(f)
+  rec = MANIFEST['sources'].get(key)
+  if rec is None: return None
+  if not same_file(f, rec['source']): return None
+
+  sndir = os.path.dirname(f)
+  if sndir != '': sndir += '/'
+  for idpath, value in rec['ids'].items():
+    if id_value(sndir, idpath) != value: return None
+
+  if output != '': output = output.rstrip('/') + '/'
+  for doc, orec in rec['outputs']:
+    if not same_file(output + doc, orec): return None
+  MANIFEST['seen'].add(key)
+  return [ doc for doc, orec in rec['outputs'] ]
+
+def record_source(f, srec, content, ids, output, dryrun):
+  '''Record a processed file in the build manifest
+
+  :param str f: file processed
+  :param list|None srec: `[mtime_ns, size, hash]` of the contents read (See `extract_docstr`), None on errors
+  :param dict content: generated content
+  :param dict ids: text file id values used
+  :param str output: output directory
+  :param bool dryrun: True if documents were not written
+  '''
+  if MANIFEST is None: return
+  key = os.path.abspath(f)
+  MANIFEST['seen'].add(key)
+  MANIFEST['changed'] = True
+  MANIFEST['sources'].pop(key, None)
+  if not srec or dryrun: return
+
+  if output != '': output = output.rstrip('/') + '/'
+  outputs = []
+  for doc, txt in content.items():
+    osig = file_sig(output + doc)
+    if osig is None: return
+    outputs.append([ doc, list(osig) + [ text_hash(txt) ] ])
+  MANIFEST['sources'][key] = { 'source': srec, 'ids': ids, 'outputs': outputs }
+
+def manifest_options(args):
+  '''Options recorded in the build manifest
+
+  :param namespace args: parsed command line options
+  :returns dict: options that change the generated documents
+
+  A manifest is only re-used if these options did not change.
+  '''
+  return {
+    'output': os.path.abspath(args.output),
+    'api': args.api,
+    'gdoc': args.gdoc,
+    'header': O_OBJHDR,
+    'prefix': O_PREFIX,
+    'manify': O_MANIFY,
+  }
+
+def load_manifest(fname, options):
+  '''Load the build manifest
+
+  :param str fname: manifest file
+  :param dict options: current options (See `manifest_options`)
+
+  Enables incremental builds.  If the file does not exist, is not
+  valid or was created with different options, an empty manifest is
+  used, and `loaded` is False.
+  '''
+  global MANIFEST
+  MANIFEST = {
+    'options': options,
+    'sources': {},
+    'previous': {},
+    'seen': set(),
+    'changed': True,
+    'loaded': False,
+  }
+  if not os.path.isfile(fname): return
+  try:
+    with open(fname,'r') as fp:
+      data = json.load(fp)
+  except (OSError, ValueError) as err:
+    sys.stderr.write('{file}: {err}\n'.format(file=fname, err=str(err)))
+    return
+  if data.get('version') != MANIFEST_VERSION: return
+  if data.get('options') != options: return
+  MANIFEST['sources'] = data.get('sources', {})
+  MANIFEST['previous'] = dict(MANIFEST['sources'])
+  MANIFEST['changed'] = False
+  MANIFEST['loaded'] = True
+
+def save_manifest(fname):
+  '''Save the build manifest
+
+  :param str fname: manifest file
+
+  Only files processed in this run are kept.  The file is only
+  written if the manifest changed.
+  '''
+  sources = { k: v for k, v in MANIFEST['sources'].items() if k in MANIFEST['seen'] }
+  if not MANIFEST['changed'] and len(sources) == len(MANIFEST['sources']): return
+  dname = os.path.dirname(fname)
+  if dname != '' and not os.path.isdir(dname): os.makedirs(dname)
+  fupdate.write_text(fname, json.dumps({
+    'version': MANIFEST_VERSION,
+    'options': MANIFEST['options'],
+    'sources': sources,
+  }, indent=1, sort_keys=True) + '\n')
+
+def prune_outputs(output, keep, dryrun):
+  '''Delete documents that are no longer generated
+
+  :param str output: output directory
+  :param set keep: documents (relative to `output`) to keep
+  :param bool dryrun: if True, only inform what would happen
+
+  Uses the build manifest, so only documents generated by previous
+  runs are considered, without walking the output directory.  Only
+  valid if a previous manifest was loaded (See `load_manifest`).
+  Directories left empty are removed.
+  '''
+  if output != '': output = output.rstrip('/') + '/'
+  for rec in MANIFEST['previous'].values():
+    for doc, orec in rec['outputs']:
+      if doc in keep: continue
+      fpath = output + doc
+      if not os.path.isfile(fpath): continue
+      if dryrun:
+        if O_Q: sys.stderr.write('{f}: WONT remove\n'.format(f=fpath))
+        continue
+      os.unlink(fpath)
+      if not O_Q: sys.stderr.write('{f}: removed\n'.format(f=fpath))
+      # Remove directories left empty
+      dname = os.path.dirname(doc)
+      while dname != '':
+        path = output + dname
+        if len(os.listdir(path)) > 0: break
+        if not O_Q: sys.stderr.write("Removing empty folder: {p}\n".format(p=path))
+        os.rmdir(path)
+        dname = os.path.dirname(dname)
+
+def extract_docstr(f, basename, content = {}, apigen='', gdocgen=None, ids=None, source=None):
   '''Extract documentation from the file
 
   :param str f: file to process
@@ -249,7 +617,12 @@ def extract_docstr(f, basename, content = {}, apigen='', gdocgen=None):
   :param dict content: dictionary that will receive generated content
   :param str apigen: If not None, generate API documentation
   :param str gdocgen: If not None, generate generic documentation):
+  :param dict|None ids: (Optional) receives the text file id values used (None if not found)
+  :param list|None source: (Optional) receives the `[mtime_ns, size, hash]` record of the contents read
   :returns int: count of generated files
+
+  The file is read once, and the signature and hash in `source` are
+  those of the bytes the documentation was extracted from.
   '''
 
   # ~ fname = os.path.basename(f)
@@ -261,7 +634,14 @@ def extract_docstr(f, basename, content = {}, apigen='', gdocgen=None):
   sndir = os.path.dirname(f)
   if sndir != '': sndir += '/'
 
-  with open(f,'r') as fp:
+  with open(f,'rb') as fp:
+    st = os.fstat(fp.fileno())
+    data = fp.read()
+  if runstats.enabled: runstats.count('bytes_read', st.st_size)
+  if not source is None: source[:] = [ st.st_mtime_ns, st.st_size, text_hash(data) ]
+
+  # Decoded as open(f,'r') does
+  with io.TextIOWrapper(io.BytesIO(data)) as fp:
     l = 0
     for line in fp:
       l += 1
@@ -271,14 +651,12 @@ def extract_docstr(f, basename, content = {}, apigen='', gdocgen=None):
         # OK, make sure the syntax is right...
         idpath = mv.group(1).replace('.','/')
         if RE_TEXT_FILE_ID_CHECK.match(os.path.basename(idpath)):
-          if os.path.isfile(sndir + idpath):
-            with open(sndir + idpath,'r') as fp:
-              txid = fp.read()
-            txid.strip()
-            if txid != '':
-              i = txid.find('\n')
-              if i > 0: txid = txid[:i].strip()
-              line = line[0:mv.start()] + txid + line[mv.end():]
+          txid = txtid.read_id(sndir + idpath)
+          if not ids is None: ids[idpath] = id_value(sndir, idpath)
+          if not txid is None:
+            line = line[0:mv.start()] + txid + line[mv.end():]
+          elif os.path.isfile(sndir + idpath):
+            pass # Empty file, left as is
           elif idpath in O_IDS:
             line = line[0:mv.start()] + O_IDS[idpath] + line[mv.end():]
           else:
@@ -427,6 +805,20 @@ def manify(srcfile, txt):
   return srcfile, txt
 
 
+def enable_stats():
+  '''Enable run statistics
+
+  Instruments the ashdoc and fwalktree functions worth measuring
+  (See `runstats`).
+  '''
+  runstats.enable()
+  ns = globals()
+  for fn in ('process_file', 'extract_docstr', 'update_file', 'gen_index'):
+    runstats.instrument(ns, fn)
+  runstats.instrument(vars(txtid), 'read_id', 'txtid.read_id')
+  runstats.instrument(vars(fwalktree), 'walktree')
+  runstats.instrument(vars(fwalktree), 'filter_file')
+
 def cli_parser():
   '''Generate ArgumetParser object
 
@@ -452,6 +844,9 @@ def cli_parser():
   cli.add_argument('--no-gdoc',dest='gdoc',help='Disable Gneric doc generation', action='store_const', const=None)
   cli.add_argument('--manify',help='Enable manify extensions', nargs='?', default=None, const='')
   cli.add_argument('-R','--recursive', help='Allow to recurse into directories', action='store_true')
+  cli.add_argument('-j','--jobs', help='Number of parallel extraction jobs (0 for one per CPU)', type=int, default=1)
+  cli.add_argument('--incremental', help='Skip files that did not change since the last run', action='store_true')
+  cli.add_argument('--manifest', help='Build manifest file for incremental runs (default: {} in the output directory)'.format(DEF_MANIFEST))
   cli.add_argument('--follow-symlinks', help='When recursive, follow symlinks', action='store_true')
   cli.add_argument('--no-follow-symlinks', dest='follow_symlinks', help='When recursive, Do not follow symlinks', action='store_false')
   cli.set_defaults(follow_symlinks=True)
@@ -459,9 +854,15 @@ def cli_parser():
   cli.add_argument('--pattern-dircfg', help='Per-directory config file', nargs='?', const='.binderrc', default=fwalktree.DEF_PATTERN_DIRCFG)
   cli.add_argument('--reset-std-patterns', help='Reset built-in patterns', action='store_true')
   cli.add_argument('--pattern-file', help='Read patterns from file', action='append')
-  cli.add_argument('--pattern', help='Add pattern rule', action='append')
+  cli.add_argument('--pattern', help='Add pattern rule (fnmatch wildcards, first match wins)', action='append')
   cli.add_argument('--pattern-test', help='Test pattern rules', action='store_true')
   cli.add_argument('--report-binary', help='Show detected binary files', action='store_true')
+  cli.add_argument('--walk-threads', help='Threads used to read directories (for network file systems)', type=int, default=1)
+  cli.add_argument('--walk-index', help='Keep an index of walked directories in file between runs, for faster recursive walks')
+  cli.add_argument('--walk-source', help='When recursive, list files from the file system (default), tracked files from git (git) or also untracked files not ignored (git-untracked)', choices=fwalktree.WALK_SOURCES, default='fs')
+  cli.add_argument('--walk-ignore', help='When recursive, skip files matching the gitignore style rules of this per-directory file (i.e. .gitignore)', action='append')
+  cli.add_argument('--stats', help='Report run statistics to stderr (also enabled by ${})'.format(ENV_ASHDOC_STATS), action='store_const', const='-')
+  cli.add_argument('--stats-file', dest='stats', help='Append run statistics as a JSON line to file')
   cli.add_argument('files', help='File(s) to process', nargs='*')
   return cli
 
@@ -488,6 +889,8 @@ def removeEmptyFolders(path, removeRoot=True):
 if __name__ == '__main__':
   cli = cli_parser()
   args = cli.parse_args()
+  stats = runstats.stats_output(args.stats, ENV_ASHDOC_STATS)
+  if not stats is None: enable_stats()
   fwalktree.apply_cli_opts(args)
   O_OBJHDR = args.header
 
@@ -539,12 +942,29 @@ if __name__ == '__main__':
   def wt_process_file(f):
     process_file(f, args.output, toc=toclst, dryrun=args.dry_run,
                   apigen=args.api, gdocgen = args.gdoc)
+  if args.jobs < 1: args.jobs = os.cpu_count() or 1
+  if args.incremental and O_MANIFY != 'view':
+    if args.manifest is None: args.manifest = os.path.join(args.output, DEF_MANIFEST)
+    load_manifest(args.manifest, manifest_options(args))
+    fwalktree.exclude_file(args.manifest)
   # ~ print(args)
-  for f in args.files:
-    if os.path.isdir(f) and args.recursive:
-      fwalktree.walktree(f, wt_process_file)
-    else:
-      wt_process_file(f)
+  if args.jobs > 1 and O_MANIFY != 'view':
+    files = []
+    explicit = set()
+    for f in args.files:
+      if os.path.isdir(f) and args.recursive:
+        fwalktree.walktree(f, files.append)
+      else:
+        files.append(f)
+        explicit.add(f)
+    process_files(files, args.jobs, args.output, toc=toclst, dryrun=args.dry_run,
+                  apigen=args.api, gdocgen = args.gdoc, explicit = explicit)
+  else:
+    for f in args.files:
+      if os.path.isdir(f) and args.recursive:
+        fwalktree.walktree(f, wt_process_file)
+      else:
+        wt_process_file(f)
 
     # ~ process_file(f, args.output,
                   # ~ toc=toclst, dryrun=args.dry_run,
@@ -553,7 +973,9 @@ if __name__ == '__main__':
   if not args.toc is None:
     gen_index(args.title,args.output.rstrip('/') + ('' if args.output == '' else '/') + args.toc, toclst, args.dry_run)
 
-  if args.prune:
+  if args.prune and not MANIFEST is None and MANIFEST['loaded']:
+    prune_outputs(args.output, set(toclst + ([] if args.toc is None else [ args.toc ])), args.dry_run)
+  elif args.prune:
     pp = len(args.output.rstrip('/'))+1
     for path,subdirs,files in os.walk(args.output):
       for name in files:
@@ -563,6 +985,7 @@ if __name__ == '__main__':
         f = fpath[pp:]
         if not args.toc is None and args.toc == f: continue
         if f in toclst: continue
+        if name == DEF_MANIFEST: continue
         if args.dry_run:
           if O_Q: sys.stderr.write('{f}: WONT remove\n'.format(f=fpath))
         else:
@@ -571,6 +994,11 @@ if __name__ == '__main__':
     if not args.dry_run:
       removeEmptyFolders(args.output)
 
+  if args.walk_index and not args.dry_run: fwalktree.save_walk_index(args.walk_index)
+  if not MANIFEST is None and not args.dry_run: save_manifest(args.manifest)
+
+  if not stats is None: runstats.report('ashdoc', stats)
+
 # ~ t = process_file('vcmp.sh')
 # ~ print(t)
 # ~ t = process_file('yesno.sh')
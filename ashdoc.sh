@@ -0,0 +1,90 @@
+#!/usr/bin/atf-sh
+
+
+
+###$_end-include
+#
+# Unit testing
+#
+[ -n "${IN_COMMON:-}" ] && return
+type atf_get_srcdir >/dev/null 2>&1 || atf_get_srcdir() { pwd; }
+. $(atf_get_srcdir)/testlib/common.sh
+
+ashdoc=$(atf_get_srcdir)/ashdoc.py
+
+xt_syntax() {
+  : =descr "verify syntax..."
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    cp -a "$ashdoc" "$w/ashdoc.py"
+    cd $w
+    python3 -m py_compile ashdoc.py
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Compile test"
+}
+
+xt_jobs_rc() {
+  : =descr "same exit code with and without --jobs"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in ashdoc fwalktree fupdate runstats txtid ; do
+      cp -a "$(dirname "$ashdoc")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src
+    printf '#!/bin/sh\n\377\376\n' > src/bin.sh
+    printf '#!/bin/sh\n#$ doc\n' > src/ok.sh
+    for args in "src/bin.sh src/ok.sh" "-R src" ; do
+      j1=$(xtf_rc python3 ashdoc.py --output=out1 -j1 $args)
+      j2=$(xtf_rc python3 ashdoc.py --output=out2 -j2 $args)
+      [ "$j1" = "$j2" ] || exit 1
+    done
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Exit codes differ with --jobs"
+}
+
+xt_prune_incremental() {
+  : =descr "--prune with --incremental removes stale documents"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in ashdoc fwalktree fupdate runstats txtid ; do
+      cp -a "$(dirname "$ashdoc")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p src out/sub
+    printf '#!/bin/sh\n#$ doc\n' > src/ok.sh
+    # First run, without a manifest
+    echo stale > out/sub/stale.md
+    python3 ashdoc.py --output=out --incremental --prune -R src
+    [ -f out/src/ok.md ] || exit 1
+    [ ! -e out/sub ] || exit 1
+    # Options changed, the manifest is discarded
+    echo stale > out/stale.md
+    python3 ashdoc.py --output=out --incremental --prune --obj-heading=2 -R src
+    [ -f out/src/ok.md ] || exit 1
+    [ ! -e out/stale.md ] || exit 1
+    # Source removed, using the manifest
+    rm src/ok.sh
+    python3 ashdoc.py --output=out --incremental --prune --obj-heading=2 -R src
+    [ ! -e out/src/ok.md ] || exit 1
+    [ -f out/.ashdoc-manifest.json ] || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Stale documents not removed"
+}
+
+xatf_init
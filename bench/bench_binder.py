@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+'''Binder benchmark suite
+
+## Description
+
+Builds a synthetic tree of scripts and snippets and measures:
+
+- `walktree` : `fwalktree.walktree` over the script tree
+- `walktree-threads` : the same, reading directories with `--walk-threads` threads
+- `bind` : binding unbound scripts
+- `rebind` : binding already bound scripts (nothing changes)
+- `unbind` : unbinding bound scripts
+- `meta` : binding with `--meta` (snippets are in a git repository)
+- `dry-run` : binding with `--dry-run`
+- `extract_docstr` : `ashdoc.extract_docstr` over scripts and snippets
+
+Every measurement runs in its own forked process, on a fresh copy of
+the tree, so that caches and peak memory usage do not carry over.
+The shape of the tree is controlled by:
+
+- `--files` : number of scripts
+- `--fanout` : include directives per script
+- `--depth` : `###$_requires` nesting depth of the snippets
+- `--lines` : lines per script
+- `--incdirs` : number of directories in the include path
+
+A slow (network) mount can be simulated for the walk measurements
+with `--latency`, which adds a delay to every directory read and
+`stat` call.
+
+The tree is generated from a fixed random seed, so results are
+comparable across commits.  Results are written as JSON, with for
+each measurement the elapsed time, files/s, lines/s, read and write
+system calls (from `/proc/self/io`, where available) and peak
+resident memory.
+
+Usage:
+
+```bash
+python3 bench/bench_binder.py [--files N] [--fanout N] [--depth N] [--output file.json]
+```
+'''
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from argparse import ArgumentParser
+
+TOPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, TOPDIR)
+import fwalktree
+import binder
+import ashdoc
+
+PHASES = [ 'walktree', 'walktree-threads', 'bind', 'rebind', 'unbind', 'meta', 'dry-run', 'extract_docstr' ]
+'''Available measurements'''
+FILES_PER_DIR = 20
+'''Scripts per generated directory'''
+SNIPPET_LINES = 20
+'''Body lines per generated snippet'''
+LATENCY = 0.0
+'''Simulated latency in seconds of directory reads and `stat` calls in walk measurements'''
+WALK_THREADS = 8
+'''Threads used by the `walktree-threads` measurement'''
+
+def gen_snippet(rnd, name, requires):
+  '''Generate snippet text
+
+  :param random.Random rnd: random generator
+  :param str name: snippet name
+  :param str|None requires: snippet required by this one
+  :returns str: snippet text
+  '''
+  fn = name.replace('.', '_')
+  txt = '#!/bin/sh\n#$ Synthetic snippet {name}\n'.format(name=name)
+  if not requires is None: txt += '###$_requires: {req}\n'.format(req=requires)
+  txt += '{fn}() {{ #$ synthetic function\n'.format(fn=fn)
+  txt += '  version=\'<%VERSION%>\'\n'
+  for i in range(SNIPPET_LINES):
+    txt += '  echo "{fn} {i} {r}"\n'.format(fn=fn, i=i, r=rnd.randint(0, 9999))
+  txt += '}\n'
+  return txt
+
+def gen_script(rnd, name, snippets, fanout, lines):
+  '''Generate script text
+
+  :param random.Random rnd: random generator
+  :param str name: script name
+  :param list snippets: snippet names that can be included
+  :param int fanout: include directives in the script
+  :param int lines: total number of lines
+  :returns str: script text
+  '''
+  body = [
+    '#!/bin/sh\n',
+    '#$ Synthetic script {name}\n'.format(name=name),
+    'version=\'<%VERSION%>\'\n',
+  ]
+  for sn in rnd.sample(snippets, min(fanout, len(snippets))):
+    body.append('###$_include: {sn}\n'.format(sn=sn))
+  while len(body) < lines:
+    body.append(rnd.choice([
+      '  local rc=0 count=$#\n',
+      '  case "$1" in\n',
+      '    --verbose|-v) v=true ;;\n',
+      '  echo "$@" 1>&2\n',
+      '# Just a comment line\n',
+      '\n',
+    ]))
+  return ''.join(body)
+
+def gen_tree(root, opts):
+  '''Generate a synthetic tree
+
+  :param str root: directory to create the tree in
+  :param namespace opts: tree parameters
+  :returns dict: tree description (`src`, `incdirs`, `files`, `lines`, `snippets`)
+
+  Snippets are spread randomly over the include directories, in chains
+  of `opts.depth` requires.  Scripts are written to `src`, in
+  sub-directories of `FILES_PER_DIR` files.
+  '''
+  rnd = random.Random(opts.seed)
+  incdirs = [ os.path.join(root, 'inc{:02d}'.format(i)) for i in range(opts.incdirs) ]
+  for d in incdirs: os.makedirs(d)
+  with open(os.path.join(incdirs[-1], 'VERSION'), 'w') as fp:
+    fp.write('1.2.3\n')
+
+  snippets = [ 'sn{:04d}.sh'.format(i) for i in range(opts.snippets) ]
+  for i, sn in enumerate(snippets):
+    req = None
+    if opts.depth > 0 and i % (opts.depth + 1) != opts.depth and i + 1 < len(snippets):
+      req = snippets[i+1]
+    with open(os.path.join(rnd.choice(incdirs), sn), 'w') as fp:
+      fp.write(gen_snippet(rnd, sn, req))
+
+  src = os.path.join(root, 'src')
+  files = []
+  for i in range(opts.files):
+    d = os.path.join(src, 'd{:03d}'.format(i // FILES_PER_DIR))
+    if not os.path.isdir(d): os.makedirs(d)
+    f = os.path.join(d, 'f{:05d}.sh'.format(i))
+    with open(f, 'w') as fp:
+      fp.write(gen_script(rnd, os.path.relpath(f, root), snippets, opts.fanout, opts.lines))
+    files.append(f)
+
+  return {
+    'src': src,
+    'incdirs': incdirs,
+    'files': files,
+    'lines': opts.files * opts.lines,
+    'snippets': snippets,
+  }
+
+def git_init(d):
+  '''Make a directory a git repository
+
+  :param str d: directory
+  :returns bool: True on success
+  '''
+  env = dict(os.environ,
+             GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+             GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+  try:
+    for cmd in [ ['git','init','-q'], ['git','add','.'], ['git','commit','-q','-m','bench'] ]:
+      subprocess.run(cmd, cwd=d, env=env, check=True,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  except (OSError, subprocess.CalledProcessError):
+    return False
+  return True
+
+def proc_io():
+  '''Read I/O counters of the current process
+
+  :returns dict|None: counters from `/proc/self/io`, None if not available
+  '''
+  try:
+    with open('/proc/self/io','r') as fp:
+      return { k: int(v) for k, v in (ln.split(':') for ln in fp) }
+  except (OSError, ValueError):
+    return None
+
+def slow_mount(latency):
+  '''Simulate a slow mount
+
+  :param float latency: delay in seconds added to directory reads and `stat` calls
+
+  Only used in the forked measurement processes.
+  '''
+  def delayed(fn):
+    def wrapper(*args, **kwargs):
+      time.sleep(latency)
+      return fn(*args, **kwargs)
+    return wrapper
+  os.scandir = delayed(os.scandir)
+  os.stat = delayed(os.stat)
+
+def run_phase(phase, tree, workdir):
+  '''Run a single measurement
+
+  :param str phase: measurement to run (See `PHASES`)
+  :param dict tree: tree description from `gen_tree`
+  :param str workdir: directory with the `unbound` and `bound` copies of the tree
+  :returns dict: measurement results
+
+  Runs in a forked process.  The tree to work on is copied before
+  the measurement starts.
+  '''
+  sys.stderr = open(os.devnull, 'w')
+  base = os.path.join(workdir, 'bound' if phase in ('rebind','unbind') else 'unbound')
+  run = os.path.join(workdir, 'run')
+  shutil.copytree(base, run, symlinks=True)
+  os.chdir(run)
+  src = os.path.relpath(tree['src'], tree['root'])
+  incdirs = [ os.path.relpath(d, tree['root']) for d in tree['incdirs'] ]
+
+  kwargs = { 'no_std_path': True, 'recursive': True }
+  if phase == 'unbind': kwargs['unbind'] = True
+  if phase == 'meta': kwargs['meta'] = binder.FMT_DEF_META
+  if phase == 'dry-run': kwargs['dry_run'] = True
+
+  files = len(tree['files'])
+  lines = tree['lines']
+  if phase in ('walktree', 'walktree-threads'):
+    if LATENCY > 0: slow_mount(LATENCY)
+    if phase == 'walktree-threads': fwalktree.cf['walk-threads'] = WALK_THREADS
+
+  io1 = proc_io()
+  start = time.perf_counter()
+  if phase in ('walktree', 'walktree-threads'):
+    found = []
+    fwalktree.walktree(src, found.append)
+    lines = None
+  elif phase == 'extract_docstr':
+    found = []
+    fwalktree.walktree('.', found.append)
+    files = len(found)
+    lines = 0
+    for f in found:
+      with open(f,'r') as fp:
+        lines += sum(1 for ln in fp)
+    io1 = proc_io()
+    start = time.perf_counter()
+    for f in found:
+      ashdoc.extract_docstr(f, f[:-3], {}, '', '')
+  else:
+    binder.Binder(include=incdirs, **kwargs).bind([src])
+  elapsed = time.perf_counter() - start
+  io2 = proc_io()
+
+  res = {
+    'seconds': elapsed,
+    'files': files,
+    'lines': lines,
+    'files_per_s': files / elapsed if elapsed > 0 else None,
+    'lines_per_s': lines / elapsed if elapsed > 0 and not lines is None else None,
+    'syscr': None,
+    'syscw': None,
+    'rchar': None,
+    'wchar': None,
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  }
+  if not (io1 is None or io2 is None):
+    for k in ('syscr', 'syscw', 'rchar', 'wchar'):
+      res[k] = io2[k] - io1[k]
+  return res
+
+def phase_child(conn, phase, tree, workdir):
+  '''Forked process entry point'''
+  try:
+    conn.send(run_phase(phase, tree, workdir))
+  except Exception as err:
+    conn.send({ 'error': '{err} (type: {type})'.format(err=str(err), type=type(err).__name__) })
+  conn.close()
+
+def measure(phase, tree, workdir, repeat):
+  '''Measure a phase
+
+  :param str phase: measurement to run
+  :param dict tree: tree description from `gen_tree`
+  :param str workdir: work directory
+  :param int repeat: number of runs, the fastest one is reported
+  :returns dict: measurement results
+  '''
+  ctx = multiprocessing.get_context('fork')
+  best = None
+  for i in range(repeat):
+    rd, wr = ctx.Pipe(False)
+    p = ctx.Process(target=phase_child, args=(wr, phase, tree, workdir))
+    p.start()
+    res = rd.recv()
+    p.join()
+    shutil.rmtree(os.path.join(workdir, 'run'), ignore_errors=True)
+    if 'error' in res: return res
+    if best is None or res['seconds'] < best['seconds']: best = res
+  return best
+
+def commit_id():
+  '''Identify the code being measured
+
+  :returns str|None: git commit of the binder source, with a `-dirty` suffix if modified
+  '''
+  try:
+    rev = subprocess.run(['git','describe','--always','--dirty'], cwd=TOPDIR,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return rev
+
+def cli_parser():
+  '''Generate ArgumentParser object
+
+  :returns ArgumentParser: argument parser object
+  '''
+  cli = ArgumentParser(prog='bench_binder', description='Binder benchmark suite')
+  cli.add_argument('--files', help='Number of scripts', type=int, default=500)
+  cli.add_argument('--fanout', help='Include directives per script', type=int, default=5)
+  cli.add_argument('--depth', help='Requires nesting depth of snippets', type=int, default=3)
+  cli.add_argument('--lines', help='Lines per script', type=int, default=200)
+  cli.add_argument('--incdirs', help='Directories in the include path', type=int, default=4)
+  cli.add_argument('--snippets', help='Number of snippets', type=int, default=100)
+  cli.add_argument('--seed', help='Random seed', type=int, default=0)
+  cli.add_argument('--repeat', help='Runs per measurement', type=int, default=3)
+  cli.add_argument('--latency', help='Simulated slow mount latency in milliseconds for walk measurements', type=float, default=0)
+  cli.add_argument('--walk-threads', help='Threads for the walktree-threads measurement', type=int, default=WALK_THREADS)
+  cli.add_argument('--phase', help='Measurement to run (default: all)', action='append', choices=PHASES)
+  cli.add_argument('-o','--output', help='Write JSON results to file instead of stdout')
+  cli.add_argument('--keep', help='Keep the generated tree in this directory')
+  return cli
+
+if __name__ == '__main__':
+  opts = cli_parser().parse_args()
+  phases = opts.phase if opts.phase else PHASES
+  LATENCY = opts.latency / 1000.0
+  WALK_THREADS = opts.walk_threads
+
+  if opts.keep:
+    if os.path.exists(opts.keep):
+      sys.stderr.write('{dir}: already exists\n'.format(dir=opts.keep))
+      sys.exit(1)
+    os.makedirs(opts.keep)
+    workdir = os.path.abspath(opts.keep)
+  else:
+    workdir = tempfile.mkdtemp(prefix='bench_binder.')
+
+  try:
+    root = os.path.join(workdir, 'unbound')
+    os.makedirs(root)
+    tree = gen_tree(root, opts)
+    tree['root'] = root
+    if 'meta' in phases and not git_init(root):
+      sys.stderr.write('git not available, skipping meta\n')
+      phases = [ p for p in phases if p != 'meta' ]
+
+    # Create a bound copy of the tree
+    shutil.copytree(root, os.path.join(workdir, 'bound'), symlinks=True)
+    cwd = os.getcwd()
+    os.chdir(os.path.join(workdir, 'bound'))
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    binder.Binder(include=[ os.path.relpath(d, root) for d in tree['incdirs'] ],
+                  no_std_path=True, recursive=True).bind([ os.path.relpath(tree['src'], root) ])
+    sys.stderr.close()
+    sys.stderr = stderr
+    os.chdir(cwd)
+
+    results = {
+      'commit': commit_id(),
+      'python': sys.version.split()[0],
+      'params': {
+        'files': opts.files,
+        'fanout': opts.fanout,
+        'depth': opts.depth,
+        'lines': opts.lines,
+        'incdirs': opts.incdirs,
+        'snippets': opts.snippets,
+        'seed': opts.seed,
+        'repeat': opts.repeat,
+        'latency': opts.latency,
+        'walk_threads': opts.walk_threads,
+      },
+      'results': {},
+    }
+    for phase in phases:
+      sys.stderr.write('{phase}...\n'.format(phase=phase))
+      results['results'][phase] = measure(phase, tree, workdir, opts.repeat)
+  finally:
+    if not opts.keep: shutil.rmtree(workdir, ignore_errors=True)
+
+  if opts.output:
+    with open(opts.output,'w') as fp:
+      json.dump(results, fp, indent=1, sort_keys=True)
+      fp.write('\n')
+  else:
+    json.dump(results, sys.stdout, indent=1, sort_keys=True)
+    sys.stdout.write('\n')
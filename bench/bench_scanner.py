@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''Directive scanner micro-benchmark
+
+## Description
+
+Measures how many lines per second can be classified by the binder
+hot loops.  The `legacy` scanner applies the individual regular
+expressions the way `bind_stream` and `include_snippet` used to do,
+while the `scanner` variant uses `binder.scan_directive` with its
+substring pre-checks.
+
+Usage:
+
+```bash
+python3 bench/bench_scanner.py [--lines N] [--repeat N]
+```
+'''
+import os
+import sys
+import time
+import random
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import binder
+
+def gen_lines(count, seed=0):
+  '''Generate synthetic script lines
+
+  :param int count: number of lines to generate
+  :param int seed: random seed
+  :returns list: list of str lines
+
+  Most lines are plain shell code, with a small proportion of
+  embedded docs, text file ids and binder directives, similar
+  to the snippets in this repository.
+  '''
+  rnd = random.Random(seed)
+  plain = [
+    '  local rc=0 count=$#\n',
+    '  case "$1" in\n',
+    '    --verbose|-v) v=true ;;\n',
+    '  echo "$@" 1>&2\n',
+    '# Just a comment line\n',
+    '\n',
+  ]
+  special = [
+    '#$ Embedded documentation\n',
+    'die() { #$ exit with a message\n',
+    'ashlib_version=\'<%VERSION%>\'\n',
+    '###$_requires: die.sh\n',
+    '  ###$_include: retry.sh\n',
+  ]
+  lines = []
+  for i in range(count):
+    lines.append(rnd.choice(special) if rnd.random() < 0.03 else rnd.choice(plain))
+  return lines
+
+def legacy_snippet(lines):
+  '''Classify lines the way `include_snippet` did'''
+  n = 0
+  for line in lines:
+    if binder.RE_END_SNIPPET.match(line): continue
+    if binder.RE_EMBED_DOC.match(line): continue
+    if binder.RE_EMBED_DOC2.search(line):
+      line = binder.RE_EMBED_DOC2.split(line,1)[0] + '\n'
+    if binder.RE_REQUIRE_SNIPPET.match(line):
+      n += 1
+      continue
+    if binder.RE_TEXT_FILE_ID.search(line): n += 1
+  return n
+
+def scanner_snippet(lines):
+  '''Classify lines the way `snippet_body` does'''
+  n = 0
+  for line in lines:
+    if not (binder.DOC_MARKER in line or binder.TEXT_FILE_ID_MARKER in line): continue
+    dv = binder.scan_directive(line)
+    if not dv is None and dv.kind == binder.D_END: continue
+    if binder.DOC_MARKER in line:
+      if binder.RE_EMBED_DOC.match(line): continue
+      if binder.RE_EMBED_DOC2.search(line):
+        line = binder.RE_EMBED_DOC2.split(line,1)[0] + '\n'
+        dv = binder.scan_directive(line)
+    if not dv is None and dv.kind == binder.D_REQUIRE:
+      n += 1
+      continue
+    if binder.TEXT_FILE_ID_MARKER in line and binder.RE_TEXT_FILE_ID.search(line): n += 1
+  return n
+
+def legacy_stream(lines):
+  '''Classify lines the way `bind_stream` did'''
+  n = 0
+  for line in lines:
+    if binder.RE_INCLUDE_SNIPPET.match(line) or binder.RE_BEGIN_SNIPPET.match(line): n += 1
+  return n
+
+def scanner_stream(lines):
+  '''Classify lines the way `bind_stream` does'''
+  n = 0
+  for line in lines:
+    dv = binder.scan_directive(line)
+    if not dv is None and (dv.kind == binder.D_INCLUDE or dv.kind == binder.D_BEGIN): n += 1
+  return n
+
+def measure(fn, lines, repeat):
+  '''Time a scanner function
+
+  :param callable fn: scanner to time
+  :param list lines: input lines
+  :param int repeat: number of runs, the best one is reported
+  :returns tuple: (float lines per second, int result)
+  '''
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    res = fn(lines)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best: best = elapsed
+  return len(lines) / best, res
+
+if __name__ == '__main__':
+  cli = ArgumentParser(prog='bench_scanner', description='Directive scanner micro-benchmark')
+  cli.add_argument('--lines', help='Number of lines to scan', type=int, default=500000)
+  cli.add_argument('--repeat', help='Runs per measurement', type=int, default=5)
+  opts = cli.parse_args()
+
+  lines = gen_lines(opts.lines)
+  for name, old, new in [
+        ('snippet', legacy_snippet, scanner_snippet),
+        ('stream', legacy_stream, scanner_stream),
+      ]:
+    old_lps, old_res = measure(old, lines, opts.repeat)
+    new_lps, new_res = measure(new, lines, opts.repeat)
+    if old_res != new_res:
+      sys.stderr.write('{name}: results differ ({old} != {new})\n'.format(name=name, old=old_res, new=new_res))
+      sys.exit(1)
+    print('{name:8} legacy: {old:12,.0f} lines/s  scanner: {new:12,.0f} lines/s  speed-up: {ratio:.1f}x'.format(
+            name = name,
+            old = old_lps,
+            new = new_lps,
+            ratio = new_lps / old_lps))
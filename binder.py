@@ -19,9 +19,19 @@ import os
 import sys
 import re
 import subprocess
-import shutil
+import io
+import json
+import hashlib
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 from argparse import ArgumentParser, Action
+from concurrent.futures import ProcessPoolExecutor
 import fwalktree
+import fwatch
+import txtid
+import runstats
+import fupdate
 
 # used for exception handling
 import inspect
@@ -34,12 +44,16 @@ cf = {
      'line': 0,
   },
   'opts': None,
+  'manifest': None,
+  'stale': 0,
 }
 '''global config settings'''
 
 
 ENV_BINDER_PATH = 'BINDER_PATH'
 '''Environment variable name used for defining snippets path'''
+ENV_BINDER_STATS = 'BINDER_STATS'
+'''Environment variable name used for enabling run statistics (See `--stats`)'''
 
 
 # Check for '\s*###$include: <snippet>'
@@ -58,6 +72,33 @@ RE_END_SNIPPET = re.compile(r'(\s*)###\$_end-include:?(\s.*|)$')
 RE_REQUIRE_SNIPPET = re.compile(r'(\s*)###\$_requires?:\s*([^#\s]+)(.*)')
 '''Regular expression for matching required snippets'''
 
+# Any of the above in a single pass
+RE_DIRECTIVE = re.compile(r'(\s*)###\$_(?:(include|begin-include|requires?):\s*([^#\s]+)(.*)|(end-include):?(?:\s.*|)$)')
+'''Regular expression matching include, begin-include, end-include and requires directives'''
+
+DIRECTIVE_MARKER = '###$_'
+'''Text that must be present in a line for it to contain a directive'''
+DOC_MARKER = '#$'
+'''Text that must be present in a line for it to contain directives or embedded docs'''
+TEXT_FILE_ID_MARKER = '<%'
+'''Text that must be present in a line for it to contain a text file id'''
+
+D_INCLUDE = 'include'
+'''Directive kind for `###$_include`'''
+D_BEGIN = 'begin-include'
+'''Directive kind for `###$_begin-include`'''
+D_END = 'end-include'
+'''Directive kind for `###$_end-include`'''
+D_REQUIRE = 'requires'
+'''Directive kind for `###$_requires`'''
+
+Directive = namedtuple('Directive', ['kind', 'prefix', 'snippet', 'comment'])
+'''Binder directive found by `scan_directive`'''
+
+# Check for satisfied requires
+RE_REQUIRES_DONE = re.compile(r'(\s*)###\$_requires-satisfied:\s*([^#\s]+)\s+as\s+(.*\S)')
+'''Regular expression for matching redundant requires markers'''
+
 # Embedded documentation
 RE_EMBED_DOC = re.compile(r'(\s*)#\$\s*')
 '''Regular expression Main pattern for matching embedded docs'''
@@ -87,15 +128,226 @@ FMT_REQUIRES_DONE = '{prefix}###$_requires-satisfied: {snippet} as {snfile}\n'
 
 included = {}
 '''hash tracking files that have been included already'''
+snippet_cache = {}
+'''Cache of processed snippet bodies (See `snippet_body`)'''
+
+BODY_REQUIRE = 1
+'''Snippet body item for requires directives'''
+BODY_TXID_ERROR = 2
+'''Snippet body item for text file ids that were not found'''
+
+depends = {
+  'files': set(),
+  'absent': set(),
+  'complete': True,
+}
+'''Files used (and snippet paths probed but not found) while binding the current file'''
+hash_cache = {}
+'''Cache of file content hashes'''
+
+DEF_MANIFEST = '.binder-cache.json'
+'''Default dependency manifest file for incremental binds'''
+MANIFEST_VERSION = 3
+'''Version of the dependency manifest format'''
+
+snippet_index = {}
+'''Index of the files found under each include directory'''
+probe_cache = {}
+'''Cache of file probes for paths not covered by `snippet_index`'''
+
+INDEX_CACHE_VERSION = 1
+'''Version of the on-disk include path index format'''
+
+def index_dir(fdir):
+  '''Create an index of the files under a directory
+
+  :param str fdir: directory to index
+  :returns dict: index of the directory
 
-def find_snippet(snippet, incdirs):
+  The returned index contains:
+
+  - `files` : set of file paths relative to `fdir`
+  - `dirs` : dictionary with the `st_mtime_ns` of every indexed directory
+  - `skip` : set of directories that were not indexed
+
+  Directories starting with `.`, directories that could not be read and
+  directories already seen through a symlink are not indexed.  Lookups
+  inside these fall back to probing the file system.
+  '''
+  idx = { 'files': set(), 'dirs': {}, 'skip': set() }
+  visited = set()
+  stack = [ '' ]
+  while len(stack):
+    rel = stack.pop()
+    dpath = fdir if rel == '' else '{dir}/{rel}'.format(dir=fdir, rel=rel)
+    try:
+      st = os.stat(dpath)
+      if (st.st_dev, st.st_ino) in visited:
+        idx['skip'].add(rel)
+        continue
+      visited.add((st.st_dev, st.st_ino))
+      idx['dirs'][rel] = st.st_mtime_ns
+      with os.scandir(dpath) as dh:
+        for de in dh:
+          name = de.name if rel == '' else rel + '/' + de.name
+          try:
+            if de.is_dir():
+              if de.name.startswith('.'):
+                idx['skip'].add(name)
+              else:
+                stack.append(name)
+            elif de.is_file():
+              idx['files'].add(name)
+          except OSError:
+            idx['skip'].add(name)
+    except OSError:
+      idx['skip'].add(rel)
+  return idx
+
+def index_valid(fdir, idx):
+  '''Check if a directory index is still up-to-date
+
+  :param str fdir: indexed directory
+  :param dict idx: index as returned by `index_dir`
+  :returns bool: True if no indexed directory was modified
+
+  Only directories are checked, as adding, removing or renaming files
+  always updates the modification time of the containing directory.
+  '''
+  for rel, mtime in idx['dirs'].items():
+    dpath = fdir if rel == '' else '{dir}/{rel}'.format(dir=fdir, rel=rel)
+    try:
+      if os.stat(dpath).st_mtime_ns != mtime: return False
+    except OSError:
+      return False
+  return True
+
+def build_index(cachefile = None):
+  '''Build the include path index
+
+  :param str|None cachefile: (Optional) file used to keep the index between runs
+
+  Indexes every directory in `cf['include_path']` (which includes
+  scoped includes) into `snippet_index`.  If `cachefile` is given,
+  previously saved indexes are re-used when still valid, and the
+  resulting index is saved back.
+  '''
+  cached = {}
+  if cachefile and os.path.isfile(cachefile):
+    try:
+      with open(cachefile,'r') as fp:
+        data = json.load(fp)
+      if data.get('version') == INDEX_CACHE_VERSION:
+        cached = data['index']
+    except (OSError, ValueError, KeyError):
+      cached = {}
+
+  changed = False
+  for fdir in cf['include_path']:
+    if fdir in snippet_index: continue
+    key = os.path.abspath(fdir)
+    if key in cached:
+      idx = {
+        'files': set(cached[key]['files']),
+        'dirs': cached[key]['dirs'],
+        'skip': set(cached[key]['skip']),
+      }
+      if index_valid(fdir, idx):
+        snippet_index[fdir] = idx
+        continue
+    snippet_index[fdir] = index_dir(fdir)
+    cached[key] = {
+      'files': sorted(snippet_index[fdir]['files']),
+      'dirs': snippet_index[fdir]['dirs'],
+      'skip': sorted(snippet_index[fdir]['skip']),
+    }
+    changed = True
+
+  if cachefile and changed:
+    try:
+      with open(cachefile,'w') as fp:
+        json.dump({'version': INDEX_CACHE_VERSION, 'index': cached}, fp)
+    except OSError as err:
+      sys.stderr.write('{file}: {err}\n'.format(file=cachefile, err=str(err)))
+
+def is_indexed_file(fdir, rel):
+  '''Check if a file exists in an include directory
+
+  :param str fdir: include directory
+  :param str rel: file path relative to `fdir`
+  :returns bool: True if `fdir/rel` is a file
+
+  Uses `snippet_index` when possible, falling back to (cached)
+  `os.path.isfile` probes for directories that are not indexed.
+  '''
+  snfile = '{dir}/{file}'.format(dir=fdir, file=rel)
+  idx = snippet_index.get(fdir)
+  if not idx is None:
+    parts = rel.split('/')
+    if not ('' in parts or '.' in parts or '..' in parts):
+      if rel in idx['files']: return True
+      for i in range(len(parts)-1, 0, -1):
+        if '/'.join(parts[:i]) in idx['skip']: break
+      else:
+        return '' in idx['skip'] and os.path.isfile(snfile)
+  return probe_file(snfile)
+
+def probe_file(f):
+  '''Check if a file exists
+
+  :param str f: file path
+  :returns bool: True if `f` is a file
+
+  Results are kept in `probe_cache`.
+  '''
+  if not f in probe_cache:
+    probe_cache[f] = os.path.isfile(f)
+    runstats.count('find_snippet.isfile')
+  return probe_cache[f]
+
+def scan_directive(line):
+  '''Scan a line for binder directives
+
+  :param str line: line to scan
+  :returns Directive|None: directive found in the line, None if the line has no directives
+
+  Lines without the directive marker are rejected without running
+  any regular expression.  Otherwise, the line is classified with
+  the single `RE_DIRECTIVE` pattern.
+  '''
+  if not DIRECTIVE_MARKER in line: return None
+  mv = RE_DIRECTIVE.match(line)
+  if mv is None: return None
+  if mv.group(5): return Directive(D_END, mv.group(1), None, '')
+  kind = mv.group(2)
+  if kind != D_INCLUDE and kind != D_BEGIN: kind = D_REQUIRE
+  return Directive(kind, mv.group(1), mv.group(3), mv.group(4).rstrip('\r\n'))
+
+def file_sig(f):
+  '''Get a file signature
+
+  :param str f: file path
+  :returns tuple|None: (st_mtime_ns, st_size) or None if the file can not be stat'ed
+  '''
+  try:
+    st = os.stat(f)
+  except OSError:
+    return None
+  return (st.st_mtime_ns, st.st_size)
+
+def find_snippet(snippet, incdirs, absent = None):
   ''' Find the given snippet file in include directories
 
   :param str snippet: name of snippet
   :param list incdirs: List of str containing directories to search
+  :param set|list|None absent: (Optional) receives the paths checked before the snippet was found
   :returns None|str: found snippet file path, None if not found
 
-  Will also check the `scoped_includes` if needed.
+  Will also check the `scoped_includes` if needed.  Directories
+  are looked up in `snippet_index` (see `build_index`).
+
+  The paths in `absent` would shadow the snippet found if they
+  were created, so they are dependencies of the look-up.
   '''
   # ~ print('CONTEXT: ', cf['context'])
   # ~ print('  SNIPPET: ',snippet)
@@ -106,39 +358,125 @@ def find_snippet(snippet, incdirs):
     if snippet[:i] in cf['scoped_includes']:
       snfile = '{dir}/{file}'.format(dir=cf['scoped_includes'][snippet[:i]],
                                       file=snippet[i+1:])
-      if os.path.isfile(snfile):
+      if is_indexed_file(cf['scoped_includes'][snippet[:i]], snippet[i+1:]):
         return snfile
+      if not absent is None: absent.add(snfile)
 
   for fdir in incdirs:
     if fdir is None: continue
     snfile = '{dir}/{snippet}'.format(dir=fdir,
                                       snippet=snippet)
-    if os.path.isfile(snfile):
-      # ~ print('  SNFILE: ', snfile)
+    if is_indexed_file(fdir, snippet):
+      # ~ print('  SNFILE: ', fdir, snippet)
       return snfile
+    if not absent is None: absent.add(snfile)
   return None
 
-def include_snippet(line, mv, cwd, reent = False):
+def snippet_body(snfile, sndir):
+  '''Get the processed body of a snippet
+
+  :param str snfile: snippet file path
+  :param str sndir: directory containing `snfile`
+  :returns dict: processed snippet with `body` and `deps` keys
+
+  Processes the snippet contents removing hashbang and embedded
+  documentation lines and replacing text file ids.  `deps` is a list
+  of `(file, signature)` for the snippet and the text id files used.
+  `absent` is a set of the paths that would shadow the text id files
+  used (See `find_snippet`).  `body` is a list containing:
+
+  - `str` : text lines, without the include prefix.
+  - `(BODY_REQUIRE, line, directive, lineno)` : a requires directive, that
+    must be resolved by the caller, as it depends on what was already
+    `included` in the current file.
+  - `(BODY_TXID_ERROR, txid, lineno)` : a text file id that was not found.
+
+  Bodies are kept in `snippet_cache`, and are re-used for as long as
+  the snippet and the text id files it uses keep the same
+  modification time and size, and no text id file that would
+  shadow them was created.
+  '''
+  ckey = (snfile, cf['opts'].doc)
+  if ckey in snippet_cache:
+    entry = snippet_cache[ckey]
+    if all(file_sig(f) == sig for f,sig in entry['deps']) \
+          and not any(probe_file(f) for f in entry['absent']):
+      return entry
+
+  deps = [ (snfile, file_sig(snfile)) ]
+  absent = set()
+  body = []
+  if runstats.enabled and not deps[0][1] is None: runstats.count('bytes_read', deps[0][1][1])
+  with open(snfile, 'r') as fp:
+    c = 0
+    for line in fp:
+      c += 1 ; cf['context']['line'] = c
+      if c == 1 and line[:3] == '#!/': continue # Skip hashbang
+      if not (DOC_MARKER in line or TEXT_FILE_ID_MARKER in line):
+        # Plain line, no need to scan it
+        body.append(line)
+        continue
+
+      dv = scan_directive(line)
+      if not dv is None and dv.kind == D_END: break
+        # ~ sys.stderr.write('{snippet}: not embeddable ({file}, {line})\n{snippet}: Found EOS in {snfile}, {snline}\n'.format(
+                      # ~ snippet=snippet,
+                      # ~ **cf['context'],
+                      # ~ snfile=snfile,
+                      # ~ snline=c))
+        # ~ return line
+      if DOC_MARKER in line:
+        # Skip embeded robodoc comments
+        if (not cf['opts'].doc) and RE_EMBED_DOC.match(line): continue
+        if RE_EMBED_DOC2.search(line):
+          line = RE_EMBED_DOC2.split(line,1)[0] + '\n'
+          dv = scan_directive(line)
+
+      if not dv is None and dv.kind == D_REQUIRE:
+        body.append((BODY_REQUIRE, line, dv, c))
+        continue
+
+      # Embedding text-file ids
+      mv = RE_TEXT_FILE_ID.search(line) if TEXT_FILE_ID_MARKER in line else None
+      if mv:
+        # OK, make sure the syntax is right...
+        idpath = mv.group(1).replace('.','/')
+        if RE_TEXT_FILE_ID_CHECK.match(os.path.basename(idpath)):
+          idfile = find_snippet(idpath,[sndir]+cf['include_path'], absent)
+          if idfile is None:
+            body.append((BODY_TXID_ERROR, mv.group(1), c))
+          else:
+            deps.append((idfile, file_sig(idfile)))
+            txid = txtid.read_id(idfile)
+            if not txid is None: line = line[0:mv.start()] + txid + line[mv.end():]
+
+      body.append(line)
+
+  snippet_cache[ckey] = { 'deps': deps, 'absent': absent, 'body': body }
+  return snippet_cache[ckey]
+
+def include_snippet(line, dv, cwd, reent = False):
   '''Include snippet
 
   :param str line: line containing include/require statement
-  :param Match mv: match object that found include/require statement
+  :param Directive dv: include/require directive found in `line`
   :param str cwd: current direct for including/requring file
   :param bool reent: (Optional, defaults to False) True if called from include_snippet, otherwise False.
 
   Search for the requested snippet and processes it.
   '''
-  prefix = mv.group(1)
-  snippet = mv.group(2)
-  comment = mv.group(3).rstrip('\r\n')
+  prefix = dv.prefix
+  snippet = dv.snippet
+  comment = dv.comment
 
   if cf['opts'].unbind:
     return FMT_INCLUDE_SNIPPET.format(prefix=prefix,
                                       snippet=snippet,
                                       comment=comment)
 
-  snfile = find_snippet(snippet,[ cwd ] + cf['include_path'])
+  snfile = find_snippet(snippet,[ cwd ] + cf['include_path'], depends['absent'])
   if snfile is None:
+    depends['complete'] = False
     sys.stderr.write('{snippet}: not found ({file}, {line})\n'.format(
                       snippet=snippet,
                       **cf['context']))
@@ -161,74 +499,33 @@ def include_snippet(line, mv, cwd, reent = False):
   # ~ print('--SNDIR:  ',sndir)
   if sndir == '': sndir = '.'
   if cf['opts'].meta:
-    meta = {
-      'snippet': snippet,
-      'fdir': fdir,
-    }
-    res = gitcmd(['remote'], sndir)
-    if res is None:
-      meta['remote'] = '<none>'
-      meta['giturl'] = '<none>'
-    else:
-      meta['remote'] = res
-      meta['giturl'] = gitcmd(['remote','get-url',res],sndir,'<none>')
-    meta['describe'] = gitcmd(['describe'],sndir,'<none>')
-    meta['log'] = gitcmd(['log','--decorate=short','-n','1','--',os.path.basename(snfile)],sndir,'<none>')
+    meta = git_metadata(snfile, sndir)
+    meta['snippet'] = snippet
 
     for ml in cf['opts'].meta.format(**meta).split('\n'):
       sntext += FMT_META_LINE.format(prefix=prefix,text=ml)
 
-  with open(snfile, 'r') as fp:
-    included[snfile] = (snippet, cf['context'])
-    oldcontext = cf['context'].copy()
-    cf['context'] = {
-     'file': snfile,
-     'line': 0,
-    }
-
-    c = 0
-    for line in fp:
-      c += 1 ; cf['context']['line'] += 1
-      if c == 1 and line[:3] == '#!/': continue # Skip hashbang
-      if RE_END_SNIPPET.match(line): break
-        # ~ sys.stderr.write('{snippet}: not embeddable ({file}, {line})\n{snippet}: Found EOS in {snfile}, {snline}\n'.format(
-                      # ~ snippet=snippet,
-                      # ~ **cf['context'],
-                      # ~ snfile=snfile,
-                      # ~ snline=c))
-        # ~ return line
-      # Skip embeded robodoc comments
-      if (not cf['opts'].doc) and RE_EMBED_DOC.match(line): continue
-      if RE_EMBED_DOC2.search(line):
-        line = RE_EMBED_DOC2.split(line,1)[0] + '\n'
-
-      mv = RE_REQUIRE_SNIPPET.match(line)
-      if mv:
-        sntext += include_snippet(line, mv, sndir, True)
-        continue
-
-      # Embedding text-file ids
-      mv = RE_TEXT_FILE_ID.search(line)
-      if mv:
-        # OK, make sure the syntax is right...
-        idpath = mv.group(1).replace('.','/')
-        if RE_TEXT_FILE_ID_CHECK.match(os.path.basename(idpath)):
-          idfile = find_snippet(idpath,[sndir]+cf['include_path'])
-          if not idfile is None:
-            txid = ''
-            with open(idfile,'r') as fp:
-              txid = fp.read()
-            txid.strip()
-            if txid != '':
-              i = txid.find('\n')
-              if i > 0: txid = txid[:i].strip()
-              line = line[0:mv.start()] + txid + line[mv.end():]
-          else:
-            sys.stderr.write('TEXT_FILE_ID: "{txid}": not found ({file}, {line})\n'.format(
-                        txid=mv.group(1), file = snippet, line = c))
-
+  included[snfile] = (snippet, cf['context'])
+  oldcontext = cf['context']
+  cf['context'] = {
+   'file': snfile,
+   'line': 0,
+  }
+
+  entry = snippet_body(snfile, sndir)
+  depends['files'].update(f for f,sig in entry['deps'])
+  depends['absent'].update(entry['absent'])
+  for item in entry['body']:
+    if isinstance(item, str):
       sntext += prefix
-      sntext += line
+      sntext += item
+    elif item[0] == BODY_REQUIRE:
+      cf['context'] = { 'file': snfile, 'line': item[3] }
+      sntext += include_snippet(item[1], item[2], sndir, True)
+    elif item[0] == BODY_TXID_ERROR:
+      depends['complete'] = False
+      sys.stderr.write('TEXT_FILE_ID: "{txid}": not found ({file}, {line})\n'.format(
+                        txid=item[1], file = snippet, line = item[2]))
 
   cf['context'] = oldcontext
 
@@ -240,46 +537,181 @@ def include_snippet(line, mv, cwd, reent = False):
 
   return sntext
 
-def bind_stream(fp,cwd):
-  rc = 0
-  orig = ''
-  moded = ''
+class BoundOutput:
+  '''Bound output writer
+
+  :param file|None fp: (Optional) output stream
+  :param callable|None opener: (Optional) function to open the output
+
+  Compares the bound output with the original input while both are
+  being produced, so that neither needs to be kept in memory.
+
+  If `fp` is given, all output is written to it.  Otherwise, output is
+  only written once it is found to differ from the input.  At that
+  point, `opener` is called with the number of characters that matched,
+  and must return a stream that already contains that many characters
+  of the original input.  With no `fp` and no `opener`, output is only
+  compared.
+  '''
+  def __init__(self, fp = None, opener = None):
+    self.fp = fp
+    self.opener = opener if fp is None else None
+    self.same = True
+    self.matched = 0
+    self.pending = ''
+    self.pending_orig = False
+
+  def read(self, txt):
+    '''Account for original input
+
+    :param str txt: text read from the input
+    '''
+    if self.same: self._compare(txt, True)
+
+  def write(self, txt):
+    '''Write bound output
+
+    :param str txt: output text
+    '''
+    if self.same:
+      if self.opener is None and not self.fp is None: self.fp.write(txt)
+      self._compare(txt, False)
+    elif not self.fp is None:
+      self.fp.write(txt)
+
+  def _compare(self, txt, orig):
+    '''Compare text with the pending text of the other side
+
+    :param str txt: new text
+    :param bool orig: True if `txt` is original input, False if it is output
+    '''
+    if self.pending != '' and self.pending_orig != orig:
+      n = min(len(self.pending), len(txt))
+      if self.pending[:n] != txt[:n]:
+        self.diverge('' if orig else txt)
+        return
+      self.matched += n
+      self.pending = self.pending[n:]
+      txt = txt[n:]
+    if txt != '':
+      self.pending += txt
+      self.pending_orig = orig
+
+  def diverge(self, txt = ''):
+    '''Mark output as different from input
+
+    :param str txt: output text not yet written
+
+    If output is written lazily, the output stream is opened and
+    all the output produced so far is written to it.
+    '''
+    self.same = False
+    if self.opener is None: return
+    self.fp = self.opener(self.matched)
+    if not self.pending_orig: self.fp.write(self.pending)
+    self.fp.write(txt)
+    self.pending = ''
+    self.opener = None
+
+  def finish(self):
+    '''Finish comparison
+
+    :returns bool: True if the output differs from the input
+    '''
+    if self.same and self.pending != '': self.diverge()
+    return not self.same
+
+  def discard(self):
+    '''Discard a lazily opened output file'''
+    if self.fp is None or not hasattr(self.fp, 'name'): return
+    self.fp.close()
+    if os.path.exists(self.fp.name): os.remove(self.fp.name)
+
+def open_output(f, matched):
+  '''Open a temporary output file for a bound file
+
+  :param str f: file being bound
+  :param int matched: characters to copy from `f`
+  :returns file: temporary file containing the first `matched` characters of `f`
+
+  The temporary file is created in the same directory as the real
+  path of `f`, so that it can be renamed over it (See `fupdate`).
+  '''
+  fp = fupdate.open_temp(f)
+  try:
+    with open(f,'r') as src:
+      while matched > 0:
+        txt = src.read(min(matched, 65536))
+        if txt == '': break
+        fp.write(txt)
+        matched -= len(txt)
+  except:
+    fp.close()
+    os.remove(fp.name)
+    raise
+  return fp
+
+def commit_output(f, fp, backup = None):
+  '''Replace a bound file with its temporary output file
+
+  :param str f: file being bound
+  :param file fp: temporary output file from `open_output`
+  :param str|None backup: (Optional) backup file name
+
+  See `fupdate.commit`.  The backup is a hard link to the old file
+  rather than a copy, unless `f` has multiple hard links.
+  '''
+  if runstats.enabled:
+    fp.flush()
+    runstats.count('files_rewritten')
+    runstats.count('bytes_written', os.path.getsize(fp.name))
+  fupdate.commit(f, fp, backup)
+
+def bind_stream(fp, cwd, out, check = False):
+  '''Bind an input stream
+
+  :param file fp: input stream
+  :param str cwd: directory of the input, used to find snippets
+  :param BoundOutput out: receives the bound output
+  :param bool check: (Optional) stop at the first difference
+  :returns bool: True if the bound output is different from the input
+  '''
   find_eos = None
 
   cf['context']['line'] = 0
 
   for line in fp:
-    orig += line
+    out.read(line)
     cf['context']['line'] += 1
+    dv = scan_directive(line)
 
     if find_eos:
       find_eos['line'] += line
-      if RE_END_SNIPPET.match(line):
+      if not dv is None and dv.kind == D_END:
         # Found EOS
-        moded += include_snippet(find_eos['line'], find_eos['mv'], cwd)
+        out.write(include_snippet(find_eos['line'], find_eos['dv'], cwd))
         find_eos = None
+    elif dv is None:
+      out.write(line)
+    elif dv.kind == D_INCLUDE:
+      out.write(include_snippet(line, dv, cwd))
+    elif dv.kind == D_BEGIN:
+      find_eos = {
+        'line': line,
+        'dv': dv,
+        'count': cf['context']['line']
+      }
     else:
-      mv = RE_INCLUDE_SNIPPET.match(line)
-      if mv:
-        moded += include_snippet(line, mv, cwd)
-        continue
-      mv = RE_BEGIN_SNIPPET.match(line)
-      if mv:
-        find_eos = {
-          'line': line,
-          'mv': mv,
-          'count': cf['context']['line']
-        }
-        continue
-      moded += line
+      out.write(line)
+    if check and not out.same: return True
 
   if find_eos:
     sys.stderr.write('{snippet}: unterminated bound snippet ({file}, {cline})\n'.format(
-                  snippet=find_eos['mv'].group(2),
+                  snippet=find_eos['dv'].snippet,
                   cline=find_eos['count'],
                   **cf['context']))
-    moded += find_eos['line']
-  return moded, orig
+    out.write(find_eos['line'])
+  return out.finish()
 
 
 def bind_file(f):
@@ -289,7 +721,18 @@ def bind_file(f):
 
   Will process the given file.  Execution is controlled via the
   `cf['opts']` global dictionary.
+
+  The bound output is compared with the file while it is generated,
+  and is only written (to a temporary file that then replaces `f`)
+  if it differs.  With `--check` nothing is written, processing stops
+  at the first difference and `cf['stale']` is incremented.
+
+  When a dependency manifest is loaded (see `load_manifest`), files
+  whose inputs did not change are skipped, and the manifest is
+  updated with the dependencies of processed files.
   '''
+  if cf['opts'].incremental and up_to_date(f): return
+
   cf['context']['file'] = f
   cf['context']['line'] = 0
 
@@ -297,21 +740,705 @@ def bind_file(f):
   if cwd == '': cwd = '.'
 
   included.clear()  # Clear the included cache...
+  depends['files'].clear()
+  depends['absent'].clear()
+  depends['complete'] = True
   # ~ sys.stderr.write("{file},{count}\n".format(file=f,count=len(included)))
 
+  if cf['opts'].check or cf['opts'].dry_run:
+    out = BoundOutput()
+  else:
+    out = BoundOutput(opener = lambda matched: open_output(f, matched))
+
+  try:
+    with open(f,'r') as fp:
+      if runstats.enabled: runstats.count('bytes_read', os.fstat(fp.fileno()).st_size)
+      cf['context']['file'] = f
+      changed = bind_stream(fp, cwd, out, cf['opts'].check)
+
+    if cf['opts'].check:
+      if changed:
+        sys.stderr.write('{file},{line}: out of date\n'.format(**cf['context']))
+        cf['stale'] += 1
+      return
+
+    if changed or cf['opts'].force:
+      sys.stderr.write('{file}: updating\n'.format(file=f))
+      if cf['opts'].dry_run: return # Don't do anything
+      if not changed: out.diverge()
+      bfile = None
+      if cf['opts'].backup:
+        bfile = '{name}{suffix}'.format(name=f, suffix=cf['opts'].backup)
+      commit_output(f, out.fp, bfile)
+  except:
+    out.discard()
+    raise
+
+  if not cf['manifest'] is None: record_depends(f)
+
+def file_hash(f):
+  '''Compute the hash of a file contents
+
+  :param str f: file path
+  :returns str|None: hex digest of the file contents, None on error
+
+  Hashes are cached for as long as the file signature does not change.
+  '''
+  sig = file_sig(f)
+  if sig is None: return None
+  if f in hash_cache and hash_cache[f][0] == sig: return hash_cache[f][1]
+  h = hashlib.sha256()
+  try:
+    with open(f,'rb') as fp:
+      for chunk in iter(lambda: fp.read(65536), b''):
+        h.update(chunk)
+  except OSError:
+    return None
+  hash_cache[f] = (sig, h.hexdigest())
+  return hash_cache[f][1]
+
+def same_file(f, rec):
+  '''Check if a file matches a manifest record
+
+  :param str f: file path
+  :param list rec: `[mtime_ns, size, hash]` as recorded in the manifest
+  :returns bool: True if the file was not modified
+
+  Files with the same signature are assumed unchanged without reading
+  them.  Otherwise the contents hash is compared.
+  '''
+  sig = file_sig(f)
+  if sig is None: return False
+  if list(sig) == rec[:2]: return True
+  return file_hash(f) == rec[2]
+
+def up_to_date(f):
+  '''Check if a file needs to be bound again
+
+  :param str f: file path
+  :returns bool: True if the file and its dependencies did not change
+
+  Uses the dependency manifest in `cf['manifest']`.  Files are never
+  skipped when using `--force` or `--meta`, as their output can change
+  even if the inputs did not.  Files are also bound again if a file
+  was created where a snippet look-up found nothing before (See
+  `find_snippet`), as it would now be used instead.
+  '''
+  if cf['opts'].force or cf['opts'].meta: return False
+  rec = cf['manifest']['files'].get(os.path.abspath(f))
+  if rec is None: return False
+  if not same_file(f, rec['file']): return False
+  for dep, drec in rec['deps'].items():
+    if not same_file(dep, drec): return False
+  for p in rec['absent']:
+    if probe_file(p): return False
+  return True
+
+def record_depends(f):
+  '''Record the dependencies of a bound file in the manifest
+
+  :param str f: file path that was bound
+
+  Files that used snippets or text file ids that could not be found
+  are removed from the manifest, so they are always processed.  The
+  paths probed by snippet look-ups before the snippet was found are
+  recorded as `absent`.  The reverse dependency index is updated in
+  all cases.
+  '''
+  key = os.path.abspath(f)
+  record_uses(f, depends['files'])
+  if not depends['complete']:
+    cf['manifest']['files'].pop(key, None)
+    return
+  rec = {
+    'file': None,
+    'deps': {},
+    'absent': sorted(set(os.path.abspath(p) for p in depends['absent'])),
+  }
+  for dep in sorted(depends['files']) + [ f ]:
+    sig = file_sig(dep)
+    h = file_hash(dep)
+    if sig is None or h is None:
+      cf['manifest']['files'].pop(key, None)
+      return
+    if dep == f:
+      rec['file'] = [ sig[0], sig[1], h ]
+    else:
+      rec['deps'][os.path.abspath(dep)] = [ sig[0], sig[1], h ]
+  cf['manifest']['files'][key] = rec
+
+def record_uses(f, deps):
+  '''Record the snippets used by a file
+
+  :param str f: file path
+  :param iterable deps: snippet and text id files used by `f`
+
+  Updates the `uses` table of the manifest, used to build the
+  reverse dependency index (See `affected_files`).
+  '''
+  cf['manifest']['users'] = None
+  sig = file_sig(f)
+  if sig is None:
+    cf['manifest']['uses'].pop(os.path.abspath(f), None)
+    return
+  cf['manifest']['uses'][os.path.abspath(f)] = {
+    'sig': list(sig),
+    'deps': sorted(set(os.path.abspath(d) for d in deps)),
+  }
+
+def scan_uses(f):
+  '''Find the snippets used by a bound file
+
+  :param str f: file path
+  :returns set: snippet and text id files used by `f`
+
+  This uses the `###$_begin-include`, `###$_include` and
+  `###$_requires-satisfied` markers found in `f`, and then
+  follows the requires directives of the found snippets to
+  get the complete set of dependencies.
+  '''
+  cwd = os.path.dirname(f)
+  if cwd == '': cwd = '.'
+
+  pending = []
   with open(f,'r') as fp:
-    cf['context']['file'] = f
-    moded, orig = bind_stream(fp,cwd)
-
-  if moded != orig or cf['opts'].force:
-    sys.stderr.write('{file}: updating\n'.format(file=f))
-    if cf['opts'].dry_run: return # Don't do anything
-    if cf['opts'].backup:
-      bfile = '{name}{suffix}'.format(name=f, suffix=cf['opts'].backup)
-      if os.path.exists(bfile): os.remove(bfile)
-      shutil.copy2(f, bfile, follow_symlinks = False)
-    with open(f,'w') as fp:
-      fp.write(moded)
+    for line in fp:
+      if not DIRECTIVE_MARKER in line: continue
+      mv = RE_REQUIRES_DONE.match(line)
+      if mv:
+        if os.path.isfile(mv.group(3)):
+          pending.append(mv.group(3))
+        continue
+      dv = scan_directive(line)
+      if not dv is None and (dv.kind == D_BEGIN or dv.kind == D_INCLUDE):
+        snfile = find_snippet(dv.snippet, [ cwd ] + cf['include_path'])
+        if not snfile is None: pending.append(snfile)
+
+  uses = set()
+  while len(pending):
+    snfile = pending.pop()
+    if snfile in uses: continue
+    sndir = os.path.dirname(snfile)
+    if sndir == '': sndir = '.'
+    entry = snippet_body(snfile, sndir)
+    uses.update(dep for dep,sig in entry['deps'])
+    for item in entry['body']:
+      if isinstance(item, str) or item[0] != BODY_REQUIRE: continue
+      dep = find_snippet(item[2].snippet, [ sndir ] + cf['include_path'])
+      if not dep is None: pending.append(dep)
+  return uses
+
+def in_root(path, root):
+  '''Check if a path is within a directory
+
+  :param str path: absolute path
+  :param str root: absolute directory path
+  :returns bool: True if `path` is `root` or is below it
+  '''
+  return path == root or path.startswith(root.rstrip('/') + '/')
+
+def mark_root(dirname, dirs):
+  '''Mark a directory as completely indexed
+
+  :param str dirname: directory that was walked
+  :param dict dirs: `st_mtime_ns` of the walked directories (See `fwalktree.walktree`)
+
+  If `dirname` is below an indexed root, the directories recorded
+  for that root are replaced by `dirs` under `dirname`.
+  '''
+  root = os.path.abspath(dirname)
+  roots = cf['manifest']['roots']
+  for r in [ r for r in roots if in_root(r, root) ]:
+    del roots[r]
+  for r, rdirs in roots.items():
+    if not in_root(root, r): continue
+    for d in [ d for d in rdirs if in_root(d, root) ]:
+      del rdirs[d]
+    rdirs.update(dirs)
+    return
+  roots[root] = dict(dirs)
+
+def root_valid(path):
+  '''Check if a directory is indexed and up-to-date
+
+  :param str path: absolute directory path
+  :returns bool: True if `path` was walked and none of its directories was modified since
+
+  Works as `index_valid`: adding, removing or renaming files always
+  updates the modification time of the containing directory.
+  '''
+  for r, rdirs in cf['manifest']['roots'].items():
+    if not in_root(path, r) or not path in rdirs: continue
+    for d, mtime in rdirs.items():
+      if not in_root(d, path): continue
+      try:
+        if os.stat(d).st_mtime_ns != mtime: return False
+      except OSError:
+        return False
+    return True
+  return False
+
+def index_uses(f):
+  '''Scan a file found walking a directory, unless already indexed
+
+  :param str f: file path
+  '''
+  rec = cf['manifest']['uses'].get(os.path.abspath(f))
+  sig = file_sig(f)
+  if rec is None or sig is None or list(sig) != rec['sig']:
+    record_uses(f, scan_uses(f))
+
+def affected_files(targets, paths):
+  '''Find files affected by changes in the given snippets
+
+  :param list targets: snippet names or paths
+  :param list paths: files and directories to consider
+  :returns list: sorted list of files that use any of the `targets`
+
+  Uses the reverse dependency index kept in the manifest (See
+  `users_index`).  Directories that were never indexed, or that were
+  modified since (See `root_valid`), are walked and their new files
+  scanned for binder markers (See `scan_uses`).  Indexed files that
+  were modified since they were indexed are scanned again.  If `paths`
+  is empty, all the indexed files are considered.
+  '''
+  snfiles = set()
+  for t in targets:
+    snfile = t if os.path.isfile(t) else find_snippet(t, [ '.' ] + cf['include_path'])
+    if snfile is None:
+      sys.stderr.write('{snippet}: not found\n'.format(snippet=t))
+      continue
+    snfiles.add(os.path.abspath(snfile))
+
+  uses = cf['manifest']['uses']
+  candidates = set()
+  if len(paths) == 0:
+    candidates.update(uses)
+  for p in paths:
+    ap = os.path.abspath(p)
+    if os.path.isdir(p) and cf['opts'].recursive:
+      if not root_valid(ap):
+        dirs = {}
+        fwalktree.VISITED_DIRS.clear()
+        fwalktree.walktree(p, index_uses, dirs)
+        mark_root(p, dirs)
+      candidates.update(f for f in uses if in_root(f, ap))
+    else:
+      candidates.add(ap)
+
+  for f in sorted(candidates):
+    if not f in uses or file_sig(f) is None or list(file_sig(f)) != uses[f]['sig']:
+      if not os.path.isfile(f):
+        uses.pop(f, None)
+        cf['manifest']['users'] = None
+        continue
+      record_uses(f, scan_uses(f))
+
+  users = users_index()
+  found = set()
+  for snfile in snfiles:
+    found.update(users.get(snfile, ()))
+  return [ os.path.relpath(f) for f in sorted(found.intersection(candidates)) ]
+
+def users_index():
+  '''Get the reverse dependency index
+
+  :returns dict: maps snippet files to the sorted list of files using them
+
+  The index is saved in the manifest, and only re-built from the
+  `uses` table after it was modified (which sets `users` to None).
+  '''
+  if cf['manifest']['users'] is None:
+    users = {}
+    for f, rec in cf['manifest']['uses'].items():
+      for dep in rec['deps']:
+        users.setdefault(dep, []).append(f)
+    cf['manifest']['users'] = { dep: sorted(users[dep]) for dep in users }
+  return cf['manifest']['users']
+
+def manifest_options():
+  '''Options that affect bound output
+
+  :returns dict: options recorded in the dependency manifest
+
+  A manifest is only re-used if these options did not change.
+  '''
+  return {
+    'unbind': bool(cf['opts'].unbind),
+    'doc': bool(cf['opts'].doc),
+    'meta': cf['opts'].meta,
+    'include_path': [ os.path.abspath(d) for d in cf['include_path'] ],
+    'scoped_includes': { k: os.path.abspath(v) for k,v in cf['scoped_includes'].items() },
+  }
+
+def load_manifest(fname):
+  '''Load dependency manifest
+
+  :param str fname: manifest file
+
+  Initializes `cf['manifest']` from `fname`.  If the file does not
+  exist, is not valid or was created with different options, an empty
+  manifest is used.  The reverse dependency index does not depend
+  on options, so it is always re-used.
+  '''
+  cf['manifest'] = {
+    'version': MANIFEST_VERSION,
+    'options': manifest_options(),
+    'files': {},
+    'uses': {},
+    'roots': {},
+    'users': {},
+  }
+  if not os.path.isfile(fname): return
+  try:
+    with open(fname,'r') as fp:
+      data = json.load(fp)
+  except (OSError, ValueError) as err:
+    sys.stderr.write('{file}: {err}\n'.format(file=fname, err=str(err)))
+    return
+  if data.get('version') != MANIFEST_VERSION: return
+  cf['manifest']['uses'] = data.get('uses', {})
+  cf['manifest']['roots'] = data.get('roots', {})
+  cf['manifest']['users'] = data.get('users')
+  if data.get('options') != cf['manifest']['options']: return
+  cf['manifest']['files'] = data.get('files', {})
+
+def save_manifest(fname):
+  '''Save dependency manifest
+
+  :param str fname: manifest file
+
+  The `users` reverse dependency index is re-generated before saving
+  if needed (See `users_index`).  The manifest is written without indentation, which lets `json` use
+  its C encoder.
+  '''
+  cf['manifest']['users'] = users_index()
+  fupdate.write_text(fname, json.dumps(cf['manifest'], sort_keys=True) + '\n')
+
+def bind_job(f, explicit = False):
+  '''Bind a file capturing its error output
+
+  :param str f: file path to bind
+  :param bool explicit: (Optional) True if `f` was named explicitly, False if it was found walking a directory
+  :returns tuple: (int failures, str stderr text, dict|None manifest record, dict|None uses record, dict|None stats)
+
+  Runs `bind_file` with `sys.stderr` redirected to a buffer.  This is
+  used from worker processes, so that the parent can report messages
+  in the same order files were submitted.  If incremental binding is
+  enabled, the dependencies recorded for `f` are returned, so that the
+  parent can update its manifest.  Likewise for run statistics.
+
+  Errors are reported and counted as in `bind_paths`: files found
+  walking a directory are handled as `fwalktree.walktree` does (binary
+  files are not failures), while any error binding an explicitly named
+  file is a failure.
+  '''
+  stderr = sys.stderr
+  sys.stderr = io.StringIO()
+  rc = 0
+  stale = cf['stale']
+  try:
+    bind_file(f)
+    rc = cf['stale'] - stale
+  except Exception as err:
+    if explicit:
+      sys.stderr.write('{file},{line}: {err} (type: {type})\n{trace}\n'.format(**cf['context'],
+                                      err=str(err),
+                                      type=type(err),
+                                      trace=itrc()))
+      rc = 1
+    else:
+      fwalktree.report_error(f, err)
+      if not isinstance(err, UnicodeDecodeError): rc = 1
+  finally:
+    txt = sys.stderr.getvalue()
+    sys.stderr = stderr
+  rec = None
+  use = None
+  if not cf['manifest'] is None:
+    rec = cf['manifest']['files'].pop(os.path.abspath(f), None)
+    use = cf['manifest']['uses'].pop(os.path.abspath(f), None)
+  return rc, txt, rec, use, runstats.take() if runstats.enabled else None
+
+def init_worker(opts, include_path, scoped_includes, index, manifest, gmeta, fwcf, stats):
+  '''Initialize a worker process
+
+  :param namespace opts: parsed command line options
+  :param list include_path: include search path
+  :param dict scoped_includes: scoped include directories
+  :param dict index: include path index
+  :param bool manifest: True if dependencies must be recorded
+  :param dict gmeta: git meta data
+  :param dict fwcf: fwalktree configuration
+  :param bool stats: True if run statistics are enabled
+
+  Each worker gets its own copy of the global configuration, so that
+  per-file state (`cf['context']`, `included`) is never shared.
+  '''
+  cf['opts'] = opts
+  cf['include_path'] = include_path
+  cf['scoped_includes'] = scoped_includes
+  snippet_index.update(index)
+  if manifest: cf['manifest'] = { 'files': {}, 'uses': {} }
+  git_meta.update(gmeta)
+  fwalktree.cf.update(fwcf)
+  if stats:
+    enable_stats()
+    runstats.take() # Drop statistics inherited from the parent
+
+def bind_files(files, jobs, explicit = ()):
+  '''Bind files using a process pool
+
+  :param list files: list of str with file paths to bind
+  :param int jobs: number of worker processes
+  :param set explicit: (Optional) files in `files` that were named explicitly (See `bind_job`)
+  :returns int: count of failed files
+
+  Files are bound in parallel, but error output is written to `stderr`
+  in the order of `files`.  Files that are up-to-date according to
+  the dependency manifest are not submitted.
+  '''
+  if cf['opts'].incremental:
+    files = [ f for f in files if not up_to_date(f) ]
+  if len(files) == 0: return 0
+  if cf['opts'].meta:
+    # Look-up git meta data once, instead of once per worker
+    for fdir in cf['include_path']:
+      top = git_toplevel(fdir)
+      if not top is None: git_repo(top)
+  rc = 0
+  chunksize = max(1, len(files) // (jobs * 4))
+  with ProcessPoolExecutor(max_workers=jobs,
+                           initializer=init_worker,
+                           initargs=(cf['opts'], cf['include_path'],
+                                     cf['scoped_includes'], snippet_index,
+                                     not cf['manifest'] is None,
+                                     git_meta, fwalktree.cf, runstats.enabled)) as pool:
+    results = pool.map(bind_job, files, [ f in explicit for f in files ], chunksize=chunksize)
+    for f, (frc, txt, rec, use, stats) in zip(files, results):
+      sys.stderr.write(txt)
+      rc += frc
+      if not stats is None: runstats.merge(stats)
+      if not cf['manifest'] is None:
+        if rec is None:
+          cf['manifest']['files'].pop(os.path.abspath(f), None)
+        else:
+          cf['manifest']['files'][os.path.abspath(f)] = rec
+        if not use is None:
+          cf['manifest']['uses'][os.path.abspath(f)] = use
+          cf['manifest']['users'] = None
+  return rc
+
+def bind_paths(paths):
+  '''Bind files and directories
+
+  :param list paths: list of str with file and directory paths
+  :returns int: count of failed files
+
+  Directories are only walked if `--recursive` is enabled.  With more
+  than one job, the trees are walked first and the files are then bound
+  in a process pool.
+  '''
+  rc = 0
+  fwalktree.VISITED_DIRS.clear()
+  if cf['opts'].jobs > 1:
+    # Walk the tree once, and bind files in a process pool
+    files = []
+    explicit = set()
+    for f in paths:
+      if os.path.isdir(f) and cf['opts'].recursive:
+        dirs = {}
+        rc += fwalktree.walktree(f,files.append,dirs)
+        if not (cf['manifest'] is None or cf['opts'].pattern_test): mark_root(f, dirs)
+      else:
+        files.append(f)
+        explicit.add(f)
+    rc += bind_files(files, cf['opts'].jobs, explicit)
+    return rc
+
+  for f in paths:
+    if os.path.isdir(f) and cf['opts'].recursive:
+      dirs = {}
+      rc += fwalktree.walktree(f,bind_file,dirs)
+      if not (cf['manifest'] is None or cf['opts'].pattern_test): mark_root(f, dirs)
+    else:
+      try:
+        bind_file(f)
+      except Exception as err:
+        sys.stderr.write('{file},{line}: {err} (type: {type})\n{trace}\n'.format(**cf['context'],
+                                        err=str(err),
+                                        type=type(err),
+                                        trace=itrc()))
+        rc += 1
+  return rc
+
+def bind_list(files):
+  '''Bind a list of files
+
+  :param list files: list of str with file paths to bind
+  :returns int: count of failed files
+
+  Uses a process pool if more than one job was requested.  Errors
+  are reported and counted as for files found walking a directory
+  (See `bind_job`).
+  '''
+  if cf['opts'].jobs > 1 and len(files) > 1: return bind_files(files, cf['opts'].jobs)
+  rc = 0
+  for f in files:
+    try:
+      bind_file(f)
+    except Exception as err:
+      fwalktree.report_error(f, err)
+      if not isinstance(err, UnicodeDecodeError): rc += 1
+  return rc
+
+def watch_add(w, files, users):
+  '''Register files and directories with a watcher
+
+  :param InotifyWatcher|PollWatcher w: file watcher
+  :param dict files: bound files (keys are absolute paths)
+  :param dict users: reverse dependency index (See `users_index`)
+
+  Watches every indexed include directory (so that new snippets are
+  detected), every snippet or text id file in use and the bound files.
+  '''
+  for fdir, idx in snippet_index.items():
+    for rel in idx['dirs']:
+      w.add_dir(fdir if rel == '' else '{dir}/{rel}'.format(dir=fdir, rel=rel))
+  for dep in users: w.add_file(dep)
+  for f in files: w.add_file(f)
+
+def watch_tree(w, dirname, walked, dirs, top = None):
+  '''Walk a directory tree, watching its directories
+
+  :param InotifyWatcher|PollWatcher w: file watcher
+  :param str dirname: directory to walk
+  :param list walked: receives the files found
+  :param dict dirs: maps the absolute paths of the directories walked to their walk top directory
+  :param str|None top: (Optional) walk top directory, if `dirname` was found walking it
+  :returns int: count of failed files
+
+  Works like `fwalktree.walktree`, but directories that are not
+  filtered out are registered with `w` before they are read, so that
+  files created while walking are not missed.
+  '''
+  rc = 0
+  def onerror(sfile, err):
+    nonlocal rc
+    fwalktree.report_error(sfile, err)
+    if not isinstance(err, UnicodeDecodeError): rc += 1
+
+  if top is None: top = dirname
+  w.add_dir(dirname)
+  dirs[os.path.abspath(dirname)] = top
+  for sfile, de, ftest in fwalktree.iter_tree(dirname, onerror = onerror, top = top):
+    if ftest: continue
+    if de.is_dir():
+      w.add_dir(sfile)
+      dirs[os.path.abspath(sfile)] = top
+    else:
+      walked.append(sfile)
+  return rc
+
+def watch(paths, interval):
+  '''Bind files and keep them up-to-date
+
+  :param list paths: files and directories to bind
+  :param float interval: polling interval, used if inotify is not available
+  :returns int: count of failed files
+
+  Files are bound once, and then the include path, the recursed
+  directories and bound files are watched for changes (See `fwatch`).
+  The include path index and the reverse dependency index are kept in
+  memory, so when a snippet changes only the files using it are bound
+  again.  Files modified outside binder are bound again, and new files
+  in recursed directories are bound if they pass the file filters.
+  New sub-directories are walked (and watched) the same way.  If
+  snippets are added or removed, all files are processed, as snippet
+  look-ups may now resolve differently.
+
+  Runs until interrupted.
+  '''
+  if cf['manifest'] is None: load_manifest(cf['opts'].manifest)
+  uses = cf['manifest']['uses']
+
+  rc = 0
+  w = fwatch.watcher(interval)
+  try:
+    dirs = {}
+    walked = []
+    for f in paths:
+      if os.path.isdir(f) and cf['opts'].recursive:
+        rc += watch_tree(w, f, walked, dirs)
+      else:
+        walked.append(f)
+    files = { os.path.abspath(f): f for f in walked }
+
+    rc += bind_list(walked)
+    for key, f in files.items():
+      sig = file_sig(f)
+      if not sig is None and (not key in uses or list(sig) != uses[key]['sig']):
+        record_uses(f, scan_uses(f))
+
+    while True:
+      users = users_index()
+      watch_add(w, files, users)
+      changed = w.wait()
+
+      # Refresh include path index
+      probe_cache.clear()
+      reindexed = False
+      for fdir, idx in list(snippet_index.items()):
+        if index_valid(fdir, idx): continue
+        snippet_index[fdir] = index_dir(fdir)
+        if snippet_index[fdir]['files'] != idx['files']: reindexed = True
+      if cf['opts'].meta: git_meta['verified'].clear()
+
+      todo = set(files) if reindexed else set()
+      found = []
+      for p in sorted(changed):
+        todo.update(users.get(p, []))
+        if p in files:
+          sig = file_sig(p)
+          if sig is None or not p in uses or list(sig) != uses[p]['sig']: todo.add(p)
+        elif p in dirs:
+          if not os.path.isdir(p): dirs.pop(p)
+        elif os.path.dirname(p) in dirs:
+          # Paths are built from the walk top, as when walking it
+          top = dirs[os.path.dirname(p)]
+          f = '{top}/{rel}'.format(top=top.rstrip('/'), rel=os.path.relpath(p, os.path.abspath(top)))
+          if f[:2] == './': f = f[2:]
+          if os.path.isdir(p):
+            # New sub-directory, walk it
+            if fwalktree.filter_path(f, top, isdir = True): continue
+            fwalktree.VISITED_DIRS.clear()
+            rc += watch_tree(w, f, found, dirs, top)
+          elif os.path.isfile(p):
+            if fwalktree.filter_path(f, top, isdir = False): continue
+            found.append(f)
+
+      for f in found:
+        p = os.path.abspath(f)
+        if p in files: continue
+        if cf['opts'].backup and p.endswith(cf['opts'].backup): continue
+        files[p] = f
+        todo.add(p)
+
+      batch = []
+      for p in sorted(todo):
+        if not os.path.isfile(p):
+          files.pop(p, None)
+          if not uses.pop(p, None) is None: cf['manifest']['users'] = None
+          continue
+        batch.append(files[p])
+      rc += bind_list(batch)
+      for f in batch:
+        if cf['opts'].dry_run or cf['opts'].check: record_uses(f, scan_uses(f))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    w.close()
+  return rc
 
 def append_path(pathspec):
   '''Append a entry to the include path
@@ -377,6 +1504,189 @@ def init_path(arginc):
   # ~ print('SCOPED_INCLUDES:',cf['scoped_includes'])
 
 git_cache = {}
+'''Cache of git command results'''
+git_meta = {
+  'dirs': {},
+  'repos': {},
+  'verified': set(),
+  'changed': False,
+}
+'''Git meta data
+
+- `dirs` : maps directories to their repository top level (or None)
+- `repos` : meta data for each repository top level
+- `verified` : repositories whose `HEAD` was checked in this run
+- `changed` : True if the meta data needs to be saved
+'''
+GIT_CACHE_VERSION = 1
+'''Version of the on-disk git meta data cache format'''
+
+def git_toplevel(sndir):
+  '''Find the git repository containing a directory
+
+  :param str sndir: directory
+  :returns str|None: repository top level directory, None if not in a repository
+  '''
+  key = os.path.abspath(sndir)
+  if not key in git_meta['dirs']:
+    git_meta['dirs'][key] = gitcmd(['rev-parse','--show-toplevel'], sndir)
+    git_meta['changed'] = True
+  return git_meta['dirs'][key]
+
+def git_repo(top):
+  '''Get the meta data of a git repository
+
+  :param str top: repository top level directory
+  :returns dict: repository meta data
+
+  Repository wide data (`remote`, `giturl`, `describe`) is looked up
+  only once per `HEAD`.  On the first use, the last commit of every
+  indexed snippet file in the repository is fetched (See `git_prefetch`).
+  '''
+  repo = git_meta['repos'].get(top)
+  if top in git_meta['verified']: return repo
+
+  head = gitcmd(['rev-parse','HEAD'], top)
+  git_meta['verified'].add(top)
+  if not repo is None and repo['head'] == head: return repo
+
+  repo = { 'head': head, 'log': {} }
+  res = gitcmd(['remote'], top)
+  if res is None:
+    repo['remote'] = '<none>'
+    repo['giturl'] = '<none>'
+  else:
+    repo['remote'] = res
+    repo['giturl'] = gitcmd(['remote','get-url',res],top,'<none>')
+  repo['describe'] = gitcmd(['describe'],top,'<none>')
+  git_meta['repos'][top] = repo
+  git_meta['changed'] = True
+  git_prefetch(top, repo)
+  return repo
+
+def git_prefetch(top, repo):
+  '''Fetch the last commit of all the snippets in a repository
+
+  :param str top: repository top level directory
+  :param dict repo: repository meta data to update
+
+  Looks for tracked files in the repository that are also in
+  `snippet_index`, and finds their last commit with a single
+  `git log` pass over the history, stopping as soon as all of
+  them are found.  The commit descriptions are then generated with
+  a single `git show`.
+  '''
+  tracked = gitcmd(['ls-files','-z'], top)
+  if tracked is None: return
+  tracked = set(tracked.split('\0'))
+
+  wanted = set()
+  for fdir, idx in snippet_index.items():
+    rdir = os.path.relpath(os.path.realpath(fdir), top)
+    if rdir == '..' or rdir.startswith('../'): continue
+    for rel in idx['files']:
+      rel = os.path.normpath(os.path.join(rdir, rel))
+      if rel in tracked: wanted.add(rel)
+  if len(wanted) == 0: return
+
+  found = {}
+  runstats.count('gitcmd.spawn')
+  proc = subprocess.Popen(['git','log','--format=%x01%H','--name-only','-z'],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          text=True,
+                          cwd=top)
+  commit = None
+  buf = ''
+  while len(wanted):
+    chunk = proc.stdout.read(65536)
+    if chunk == '': break
+    buf += chunk
+    items = buf.split('\0')
+    buf = items.pop()
+    for item in items:
+      item = item.lstrip('\n')
+      if item.startswith('\x01'):
+        commit = item[1:]
+      elif item in wanted:
+        found[item] = commit
+        wanted.remove(item)
+  proc.stdout.close()
+  proc.terminate()
+  proc.wait()
+
+  texts = {}
+  commits = sorted(set(found.values()))
+  if len(commits):
+    res = gitcmd(['show','-s','--decorate=short'] + commits, top)
+    if not res is None:
+      for txt in re.split(r'^(?=commit )', res, flags=re.MULTILINE):
+        txt = txt.strip()
+        if txt == '': continue
+        texts[txt.split()[1]] = txt
+  for rel, commit in found.items():
+    if commit in texts: repo['log'][rel] = texts[commit]
+
+def git_metadata(snfile, sndir):
+  '''Get the git meta data for a snippet
+
+  :param str snfile: snippet file
+  :param str sndir: directory containing `snfile`
+  :returns dict: meta data used to format `--meta` sections
+  '''
+  meta = {
+    'fdir': sndir,
+    'remote': '<none>',
+    'giturl': '<none>',
+    'describe': '<none>',
+    'log': '<none>',
+  }
+  top = git_toplevel(sndir)
+  if top is None: return meta
+  repo = git_repo(top)
+  rel = os.path.relpath(os.path.join(os.path.realpath(sndir), os.path.basename(snfile)), top)
+  if not rel in repo['log']:
+    repo['log'][rel] = gitcmd(['log','--decorate=short','-n','1','--',rel],top)
+    git_meta['changed'] = True
+  meta['remote'] = repo['remote']
+  meta['giturl'] = repo['giturl']
+  meta['describe'] = repo['describe']
+  if not repo['log'][rel] is None: meta['log'] = repo['log'][rel]
+  return meta
+
+def load_git_cache(fname):
+  '''Load git meta data cache
+
+  :param str fname: cache file
+
+  Repository data is re-used as long as the repository `HEAD`
+  did not change.
+  '''
+  if not os.path.isfile(fname): return
+  try:
+    with open(fname,'r') as fp:
+      data = json.load(fp)
+  except (OSError, ValueError) as err:
+    sys.stderr.write('{file}: {err}\n'.format(file=fname, err=str(err)))
+    return
+  if data.get('version') != GIT_CACHE_VERSION: return
+  git_meta['dirs'].update(data.get('dirs', {}))
+  git_meta['repos'].update(data.get('repos', {}))
+
+def save_git_cache(fname):
+  '''Save git meta data cache
+
+  :param str fname: cache file
+  '''
+  if not git_meta['changed']: return
+  with open(fname,'w') as fp:
+    json.dump({
+      'version': GIT_CACHE_VERSION,
+      'dirs': git_meta['dirs'],
+      'repos': git_meta['repos'],
+    }, fp, indent=1, sort_keys=True)
+    fp.write('\n')
+
 def gitcmd(cmdline,cwd, err=None):
   '''Execute the given git command
 
@@ -396,10 +1706,13 @@ def gitcmd(cmdline,cwd, err=None):
 
   ckey = str([cmdline,cwd])
   if not ckey in git_cache:
+    runstats.count('gitcmd.spawn')
     git_cache[ckey] = subprocess.run(cmdline,
                                      capture_output=True,
                                      text=True,
                                      cwd=cwd)
+  else:
+    runstats.count('gitcmd.cache_hit')
 
   if git_cache[ckey].returncode == 0 and git_cache[ckey].stdout != '':
     return git_cache[ckey].stdout.strip()
@@ -423,6 +1736,211 @@ def itrc():
             context = fr.code_context[fr.index].strip('\r\n'))
   return txt #.rstrip('\r\n')
 
+def configure(opts):
+  '''Configure binder from options
+
+  :param namespace opts: options as created by `cli_parser`
+
+  Sets `cf['opts']`, the file filters, the include path and its index,
+  and loads the git meta data cache if requested.  The dependency
+  manifest and cache files are excluded from walks.
+  '''
+  cf['opts'] = opts
+  fwalktree.apply_cli_opts(opts)
+  for f in (opts.manifest, opts.index_cache, opts.git_cache):
+    if f: fwalktree.exclude_file(f)
+  init_path(opts.include)
+  build_index(opts.index_cache)
+  if opts.meta and opts.git_cache:
+    load_git_cache(opts.git_cache)
+  if opts.jobs < 1: opts.jobs = os.cpu_count() or 1
+
+def enable_stats():
+  '''Enable run statistics
+
+  Instruments the binder and fwalktree functions worth measuring
+  (See `runstats`).
+  '''
+  runstats.enable()
+  ns = globals()
+  for fn in ('bind_file', 'bind_stream', 'include_snippet', 'snippet_body',
+             'find_snippet', 'gitcmd', 'commit_output'):
+    runstats.instrument(ns, fn)
+  runstats.instrument(ns, 'is_indexed_file', 'find_snippet.probe')
+  runstats.instrument(vars(txtid), 'read_id', 'txtid.read_id')
+  runstats.instrument(vars(fwalktree), 'walktree')
+  runstats.instrument(vars(fwalktree), 'filter_file')
+
+def save_caches():
+  '''Save the git meta data cache, the dependency manifest and the walk index
+
+  Only caches that were requested are saved, and nothing is saved
+  with `--dry-run`.  The manifest is not saved with `--check`.
+  '''
+  if cf['opts'].meta and cf['opts'].git_cache and not cf['opts'].dry_run:
+    save_git_cache(cf['opts'].git_cache)
+  if not cf['manifest'] is None and (cf['opts'].incremental or cf['opts'].affected_by) \
+        and not (cf['opts'].dry_run or cf['opts'].check):
+    save_manifest(cf['opts'].manifest)
+  if cf['opts'].walk_index and not cf['opts'].dry_run:
+    fwalktree.save_walk_index(cf['opts'].walk_index)
+
+STATE_VARS = ('cf', 'included', 'snippet_cache', 'depends', 'hash_cache',
+              'snippet_index', 'probe_cache', 'git_cache', 'git_meta')
+'''Module variables holding the binder state (See `Binder`)'''
+ACTIVE_LOCK = threading.RLock()
+'''Lock held while a `Binder` instance state is the current binder state'''
+
+class Binder:
+  '''Binder engine
+
+  :param list include: (Optional) include directories, same as `-I`
+  :param kwargs: options, named as the `cli_parser` destinations (e.g. `unbind`, `doc`, `recursive`, `no_std_path`)
+
+  Binds files, directory trees and strings from Python code.  Every
+  instance has its own options, include path and caches (include
+  path index, snippet bodies, file hashes, git meta data), so that
+  they stay warm across calls.  Example:
+
+  ```python
+  import binder
+
+  with binder.Binder(include=['lib'], recursive=True) as bd:
+    rc = bd.bind(['scripts', 'docs/py'])
+    txt = bd.bind_text(script)
+  ```
+
+  The binder functions work on module variables, so the instance
+  state is swapped in for the duration of each call.  Calls from
+  multiple threads (on the same or different instances) are
+  serialized with `ACTIVE_LOCK`.
+  '''
+  def __init__(self, include = None, **kwargs):
+    opts = cli_parser().parse_args([])
+    for k, v in kwargs.items():
+      if k == 'file' or not hasattr(opts, k): raise TypeError('{opt}: unknown binder option'.format(opt=k))
+      setattr(opts, k, v)
+    if not include is None: opts.include = list(include)
+    self.opts = opts
+
+    self.state = {
+      'cf': {
+        'include_path': [],
+        'scoped_includes': {},
+        'context': { 'file': '<stdin>', 'line': 0 },
+        'opts': opts,
+        'manifest': None,
+        'stale': 0,
+      },
+      'included': {},
+      'snippet_cache': {},
+      'depends': { 'files': set(), 'absent': set(), 'complete': True },
+      'hash_cache': {},
+      'snippet_index': {},
+      'probe_cache': {},
+      'git_cache': {},
+      'git_meta': { 'dirs': {}, 'repos': {}, 'verified': set(), 'changed': False },
+    }
+    self.fwcf = dict(fwalktree.cf)
+    self.fwcf['filter'] = list(fwalktree.cf['filter'])
+    self.fwcf['cli-filter'] = []
+    self.fwcf['exclude-files'] = {}
+    self.walk_index = None
+
+    with self._active():
+      configure(opts)
+      if opts.incremental: load_manifest(opts.manifest)
+
+  @contextmanager
+  def _active(self):
+    '''Make this instance state the current binder state
+
+    `ACTIVE_LOCK` is held until the previous state is restored.  The
+    `fwalktree` walk state (visited directories and per-directory rules
+    in effect) is also replaced, so that a walk in progress outside
+    this instance is not disturbed.
+    '''
+    with ACTIVE_LOCK:
+      mod = globals()
+      saved = { k: mod[k] for k in STATE_VARS }
+      fwsaved = (fwalktree.cf, fwalktree.WALK_INDEX, fwalktree.VISITED_DIRS,
+                 fwalktree.FILTER_LAYERS, fwalktree.FILTER_CURRENT)
+      mod.update(self.state)
+      fwalktree.cf = self.fwcf
+      fwalktree.WALK_INDEX = self.walk_index
+      fwalktree.VISITED_DIRS = {}
+      fwalktree.FILTER_LAYERS = []
+      fwalktree.FILTER_CURRENT = { k: None for k in fwsaved[4] }
+      try:
+        yield
+      finally:
+        self.walk_index = fwalktree.WALK_INDEX
+        mod.update(saved)
+        (fwalktree.cf, fwalktree.WALK_INDEX, fwalktree.VISITED_DIRS,
+         fwalktree.FILTER_LAYERS, fwalktree.FILTER_CURRENT) = fwsaved
+
+  def bind(self, paths):
+    '''Bind files and directories
+
+    :param list paths: list of str with file and directory paths
+    :returns int: count of failed files (or out of date files with `check`)
+
+    Errors are reported to `stderr`, as with the command line.
+    '''
+    with self._active():
+      stale = cf['stale']
+      rc = bind_paths(paths)
+      return rc + cf['stale'] - stale
+
+  def bind_file(self, f):
+    '''Bind a single file
+
+    :param str f: file path to bind
+
+    Unlike `bind`, errors are raised as exceptions.
+    '''
+    with self._active():
+      bind_file(f)
+
+  def bind_text(self, txt, cwd = '.'):
+    '''Bind a string
+
+    :param str txt: text to bind
+    :param str cwd: (Optional) directory used to look-up snippets first
+    :returns str: bound text
+    '''
+    with self._active():
+      cf['context']['file'] = '<string>'
+      cf['context']['line'] = 0
+      included.clear()
+      out = BoundOutput(io.StringIO())
+      bind_stream(io.StringIO(txt), cwd, out)
+      return out.fp.getvalue()
+
+  def affected(self, targets, paths = []):
+    '''Find files that use the given snippets
+
+    :param list targets: snippet names or paths
+    :param list paths: (Optional) files and directories to consider
+    :returns list: sorted list of affected files
+
+    See `affected_files`.
+    '''
+    with self._active():
+      if cf['manifest'] is None: load_manifest(self.opts.manifest)
+      return affected_files(targets, paths)
+
+  def close(self):
+    '''Save caches (See `save_caches`)'''
+    with self._active():
+      save_caches()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.close()
+
 def cli_parser():
   '''Generate ArgumentParser object
 
@@ -430,14 +1948,24 @@ def cli_parser():
   '''
   cli = ArgumentParser(prog='binder', description='Snippets binder')
   cli.add_argument('--dry-run', help='Do not modify files', action='store_true')
+  cli.add_argument('--check', help='Only check if files are up-to-date, exit with the count of out of date files', action='store_true')
   cli.add_argument('-I','--include', help='Add Include path', action='append')
   cli.add_argument('-b','--backup', help='Backup changed files', nargs='?', const ='~')
   cli.add_argument('-M','--meta', help='Add meta data to snippets', nargs='?', const = FMT_DEF_META)
+  cli.add_argument('--git-cache', help='Keep git meta data in file between runs')
   cli.add_argument('-f','--force', help='Force output even when no change', action='store_true')
   cli.add_argument('-u','--unbind', help='Un-bind file', action='store_true')
   cli.add_argument('-d','--doc', help='Include embedded documentation', action='store_true')
   cli.add_argument('--no-std-path', help='Do not use standard path', action='store_true')
+  cli.add_argument('--index-cache', help='Keep include path index in file between runs')
+  cli.add_argument('--incremental', help='Skip files whose dependencies did not change', action='store_true')
+  cli.add_argument('--manifest', help='Dependency manifest file for incremental binds', default=DEF_MANIFEST)
+  cli.add_argument('--affected-by', help='Only bind files that use the given snippet', action='append')
+  cli.add_argument('--list-affected', help='List files affected by --affected-by snippets and exit', action='store_true')
+  cli.add_argument('--watch', help='Keep running, binding files again when they or their snippets change', action='store_true')
+  cli.add_argument('--watch-interval', help='Polling interval in seconds for --watch when inotify is not available', type=float, default=fwatch.DEF_INTERVAL)
   cli.add_argument('-R','--recursive', help='Allow to recurse into directories', action='store_true')
+  cli.add_argument('-j','--jobs', help='Number of parallel jobs (0 for one per CPU)', type=int, default=1)
   cli.add_argument('--follow-symlinks', help='When recursive, follow symlinks', action='store_true')
   cli.add_argument('--no-follow-symlinks', dest='follow_symlinks', help='When recursive, Do not follow symlinks', action='store_false')
   cli.set_defaults(follow_symlinks=True)
@@ -445,10 +1973,16 @@ def cli_parser():
   cli.add_argument('--pattern-dircfg', help='Per-directory config file', nargs='?', const='.binderrc', default=fwalktree.DEF_PATTERN_DIRCFG)
   cli.add_argument('--reset-std-patterns', help='Reset built-in patterns', action='store_true')
   cli.add_argument('--pattern-file', help='Read patterns from file', action='append')
-  cli.add_argument('--pattern', help='Add pattern rule', action='append')
+  cli.add_argument('--pattern', help='Add pattern rule (fnmatch wildcards, first match wins)', action='append')
   cli.add_argument('--pattern-test', help='Test pattern rules', action='store_true')
   cli.add_argument('--report-binary', help='Show detected binary files', action='store_true')
+  cli.add_argument('--walk-threads', help='Threads used to read directories (for network file systems)', type=int, default=1)
+  cli.add_argument('--walk-index', help='Keep an index of walked directories in file between runs, for faster recursive walks')
+  cli.add_argument('--walk-source', help='When recursive, list files from the file system (default), tracked files from git (git) or also untracked files not ignored (git-untracked)', choices=fwalktree.WALK_SOURCES, default='fs')
+  cli.add_argument('--walk-ignore', help='When recursive, skip files matching the gitignore style rules of this per-directory file (i.e. .gitignore)', action='append')
   cli.add_argument('--dump-stack', help='Dump stack on errors', action='store_true')
+  cli.add_argument('--stats', help='Report run statistics to stderr (also enabled by ${})'.format(ENV_BINDER_STATS), action='store_const', const='-')
+  cli.add_argument('--stats-file', dest='stats', help='Append run statistics as a JSON line to file')
   cli.add_argument('file', help='File to process', nargs='*')
 
   return cli
@@ -458,7 +1992,9 @@ if __name__ == '__main__':
 
   cf['opts'] = cli.parse_args()
 
-  fwalktree.apply_cli_opts(cf['opts'])
+  stats = runstats.stats_output(cf['opts'].stats, ENV_BINDER_STATS)
+  if not stats is None: enable_stats()
+  configure(cf['opts'])
 
   # ~ if cf['opts'].reset_std_patterns: cf['filter'] = []
   # ~ if cf['opts'].pattern:
@@ -468,16 +2004,25 @@ if __name__ == '__main__':
     # ~ for cfg in cf['opts'].pattern_file:
       # ~ fwalktree.read_filtercfg(cfg,'cli-filter')
 
-  init_path(cf['opts'].include)
+  if (cf['opts'].incremental and len(cf['opts'].file)) or cf['opts'].affected_by:
+    load_manifest(cf['opts'].manifest)
   #print(cf)
   #sys.exit(0)
 
   rc = 0
-  if len(cf['opts'].file):
-    for f in cf['opts'].file:
-      if os.path.isdir(f) and cf['opts'].recursive:
-        rc += fwalktree.walktree(f,bind_file)
-      else:
+  if cf['opts'].watch:
+    # Bind files and keep them up-to-date
+    if len(cf['opts'].file) == 0: cli.error('--watch requires files to process')
+    rc += watch(cf['opts'].file, cf['opts'].watch_interval)
+  elif cf['opts'].affected_by:
+    # Only bind files that depend on the given snippets
+    files = affected_files(cf['opts'].affected_by, cf['opts'].file)
+    if cf['opts'].list_affected:
+      for f in files: print(f)
+    elif cf['opts'].jobs > 1:
+      rc += bind_files(files, cf['opts'].jobs, set(files))
+    else:
+      for f in files:
         try:
           bind_file(f)
         except Exception as err:
@@ -486,12 +2031,17 @@ if __name__ == '__main__':
                                           type=type(err),
                                           trace=itrc()))
           rc += 1
+  elif len(cf['opts'].file):
+    rc += bind_paths(cf['opts'].file)
   else:
     # Use binder as a filter
     try:
-      moded, orig = bind_stream(sys.stdin, '.')
-      if moded != orig or cf['opts'].force:
-        sys.stdout.write(moded)
+      if cf['opts'].check:
+        if bind_stream(sys.stdin, '.', BoundOutput(), True): rc += 1
+      else:
+        out = BoundOutput(io.StringIO())
+        if bind_stream(sys.stdin, '.', out) or cf['opts'].force:
+          sys.stdout.write(out.fp.getvalue())
     except Exception as err:
       sys.stderr.write('{file},{line}: {err} (type: {type})\n{trace}\n'.format(**cf['context'],
                                         err=str(err),
@@ -499,4 +2049,8 @@ if __name__ == '__main__':
                                         trace=itrc()))
       rc += 1
 
+  rc += cf['stale']
+  save_caches()
+  if not stats is None: runstats.report('binder', stats)
+
   sys.exit(rc)
@@ -28,6 +28,271 @@ xt_syntax() {
   [ $rc -eq 0 ] || atf_fail "Compile test"
 }
 
+xt_jobs_rc() {
+  : =descr "same exit code with and without --jobs"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src
+    printf '#!/bin/sh\n\377\376\n' > src/bin.sh
+    printf '#!/bin/sh\necho ok\n' > src/ok.sh
+    for args in "src/bin.sh src/ok.sh" "-R src" ; do
+      j1=$(xtf_rc python3 binder.py --no-std-path -j1 $args)
+      j2=$(xtf_rc python3 binder.py --no-std-path -j2 $args)
+      [ "$j1" = "$j2" ] || exit 1
+    done
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Exit codes differ with --jobs"
+}
+
+xt_incremental_shadow() {
+  : =descr "incremental binds notice snippets shadowing the ones used"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src lib lib2
+    printf '#!/bin/sh\n###$_include: a.sh\n###$_include: b.sh\n' > src/one.sh
+    printf 'echo "<%%ID%%>"\n' > lib/b.sh
+    for j in 1 2 ; do
+      echo 'echo lib' > lib/a.sh
+      echo 'lib2' > lib2/ID
+      rm -f src/a.sh lib/ID
+      python3 binder.py --no-std-path -I lib -I lib2 --incremental -j$j src/one.sh
+      grep -q '^echo lib$' src/one.sh || exit 1
+      grep -q '^echo "lib2"$' src/one.sh || exit 1
+      echo 'echo src' > src/a.sh
+      python3 binder.py --no-std-path -I lib -I lib2 --incremental -j$j src/one.sh
+      grep -q '^echo src$' src/one.sh || exit 1
+      echo 'lib' > lib/ID
+      python3 binder.py --no-std-path -I lib -I lib2 --incremental -j$j src/one.sh
+      grep -q '^echo "lib"$' src/one.sh || exit 1
+    done
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Shadowing snippet not used"
+}
+
+xt_skip_caches() {
+  : =descr "cache files are not bound when walking"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src
+    cd src
+    printf '#!/bin/sh\necho ok\n' > ok.sh
+    for i in 1 2 ; do
+      python3 ../binder.py --no-std-path --incremental -f -R \
+		--index-cache idx.json --walk-index walk.json . 2> ../log
+      cat ../log
+      grep -q 'ok.sh: updating' ../log || exit 1
+      grep -q '\.json' ../log && exit 1
+    done
+    [ -f .binder-cache.json ] || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Cache files were walked"
+}
+
+xt_watch_new_dir() {
+  : =descr "--watch binds files in new sub-directories"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src lib
+    echo 'echo lib' > lib/a.sh
+    printf '#!/bin/sh\n###$_include: a.sh\n' > src/one.sh
+    timeout -s INT 5 python3 binder.py --no-std-path -I lib -R --watch src &
+    sleep 2
+    mkdir -p src/new/deep
+    printf '#!/bin/sh\n###$_include: a.sh\n' > src/new/deep/two.sh
+    wait || :
+    grep -q '^echo lib$' src/one.sh || exit 1
+    grep -q '^echo lib$' src/new/deep/two.sh || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Files in new directories not bound"
+}
+
+xt_watch_dir_rules() {
+  : =descr "--watch applies the rules of parent directories to new files"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p src/sub lib
+    echo 'echo lib' > lib/a.sh
+    echo 'F-skip*' > src/.binderrc
+    echo 'ign*' > src/.gitignore
+    timeout -s INT 5 python3 binder.py --no-std-path -I lib -R --walk-ignore .gitignore --watch src &
+    sleep 2
+    mkdir -p src/new
+    for d in sub new ; do
+      for f in skip1 ign1 ok1 ; do
+        printf '#!/bin/sh\n###$_include: a.sh\n' > src/$d/$f.sh
+      done
+    done
+    wait || :
+    for d in sub new ; do
+      grep -q '^echo lib$' src/$d/ok1.sh || exit 1
+      ! grep -q '^echo lib$' src/$d/skip1.sh || exit 1
+      ! grep -q '^echo lib$' src/$d/ign1.sh || exit 1
+    done
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Parent directory rules not applied"
+}
+
+xt_walk_index_root() {
+  : =descr "walk index verdicts depend on the walk top directory"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p src/a
+    echo 'echo x' > src/a/x.sh
+    # Directories modified recently are not indexed
+    touch -d '1 hour ago' src/a src
+    cd src
+    python3 ../binder.py --pattern=-/a/x.sh --walk-index ../idx --pattern-test -R . > ../log
+    grep -q 'a/x.sh - FILTERED' ../log || exit 1
+    cd a
+    python3 ../../binder.py --pattern=-/a/x.sh --walk-index ../../idx --pattern-test -R . > ../../log
+    grep -q 'x.sh - PROCESS' ../../log || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Verdict replayed from another walk top"
+}
+
+xt_affected_new_file() {
+  : =descr "--list-affected finds files added after indexing"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p src/sub lib
+    echo 'echo lib' > lib/a.sh
+    printf '#!/bin/sh\n###$_include: a.sh\n' > src/one.sh
+    python3 binder.py --no-std-path -I lib --incremental --affected-by a.sh --list-affected -R src > log
+    grep -q 'src/one.sh' log || exit 1
+    printf '#!/bin/sh\n###$_include: a.sh\n' > src/sub/two.sh
+    python3 binder.py --no-std-path -I lib --incremental --affected-by a.sh --list-affected -R src > log
+    grep -q 'src/one.sh' log || exit 1
+    grep -q 'src/sub/two.sh' log || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "New file not listed"
+}
+
+xt_api_nested_walk() {
+  : =descr "Binder calls do not disturb a walk in progress"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p src/a src/b
+    echo 'F-skip*' > src/a/.binderrc
+    for d in a b ; do
+      echo 'echo x' > src/$d/skip1.sh
+      echo 'echo x' > src/$d/ok.sh
+    done
+    python3 - <<-_EOF_ || exit 1
+	import binder, fwalktree
+	fwalktree.cf['pattern-dircfg'] = '.binderrc'
+	def walk(inner):
+	  res = []
+	  fwalktree.VISITED_DIRS.clear()
+	  for sfile, de, ftest in fwalktree.iter_tree('src'):
+	    res.append((sfile, ftest))
+	    if inner and sfile.endswith('/ok.sh'):
+	      binder.Binder(recursive=True).bind(['src/a', 'src/b'])
+	  return res
+	assert walk(False) == walk(True)
+	_EOF_
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Walk state changed by Binder"
+}
+
+xt_txtid_values() {
+  : =descr "text file id values"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in binder fwalktree fupdate fwatch runstats txtid ; do
+      cp -a "$(dirname "$binder")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir src lib
+    printf '#!/bin/sh\n###$_include: a.sh\n' > src/one.sh
+    printf 'echo "<%%BLANK%%>"\necho "<%%EMPTY%%>"\necho "<%%TWO%%>"\n' > lib/a.sh
+    printf '  \nX\n' > lib/BLANK
+    : > lib/EMPTY
+    printf ' v1 \nv2\n' > lib/TWO
+    python3 binder.py --no-std-path -I lib src/one.sh
+    grep -q '^echo ""$' src/one.sh || exit 1
+    grep -q '^echo "<%EMPTY%>"$' src/one.sh || exit 1
+    grep -q '^echo "v1"$' src/one.sh || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Text file id values"
+}
+
 # TODO:tests
 # - -I
 # - test include heristics
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''Atomic file updates
+
+## Description
+
+This module is used to replace file contents without leaving partially
+written files behind.  New contents are written to a temporary file
+in the same directory as the target, which is then renamed over it.
+
+- `open_temp(f)` : create the temporary file for `f`
+- `commit(f, fp, backup)` : replace `f` with the temporary file
+- `same_text(f, txt)` : compare a file with a string without reading it whole
+- `write_text(f, txt, backup)` : replace the contents of a file with a string
+
+'''
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 65536
+'''Characters to read at a time when comparing'''
+
+def open_temp(f):
+  '''Create a temporary file to replace a file
+
+  :param str f: file that will be replaced
+  :returns file: temporary file opened for writing text
+
+  The temporary file is created in the same directory as the real
+  path of `f`, so that it can be renamed over it.
+  '''
+  target = os.path.realpath(f)
+  return tempfile.NamedTemporaryFile(mode='w',
+                                     dir=os.path.dirname(target),
+                                     prefix='.{}.'.format(os.path.basename(target)),
+                                     suffix='.tmp',
+                                     delete=False)
+
+def make_backup(f, bfile, nlink):
+  '''Keep the current contents of a file in a backup file
+
+  :param str f: file about to be replaced
+  :param str bfile: backup file name
+  :param int nlink: number of hard links of the real path of `f`
+
+  The backup is a hard link to `f` (or `f` renamed, if hard links are
+  not supported), as `f` gets a new inode when it is replaced.  Files
+  with multiple hard links are updated in place, so their backup must
+  be a copy.
+  '''
+  if os.path.lexists(bfile): os.remove(bfile)
+  if nlink == 1:
+    try:
+      os.link(f, bfile, follow_symlinks = False)
+      return
+    except OSError:
+      if not os.path.islink(f):
+        os.rename(f, bfile)
+        return
+  shutil.copy2(f, bfile, follow_symlinks = False)
+
+def commit(f, fp, backup = None):
+  '''Replace a file with its temporary file
+
+  :param str f: file being replaced
+  :param file fp: temporary file from `open_temp`
+  :param str|None backup: (Optional) backup file name
+
+  The temporary file gets the permissions of `f` and is renamed over
+  the real path of `f`.  Files with multiple hard links are updated in
+  place instead, so that all links see the new contents.  If `f` does
+  not exist yet, the temporary file gets the default permissions.
+  '''
+  fp.close()
+  target = os.path.realpath(f)
+  try:
+    try:
+      nlink = os.stat(target).st_nlink
+    except FileNotFoundError:
+      nlink = 0
+    if nlink == 1:
+      shutil.copymode(target, fp.name)
+    elif nlink == 0:
+      umask = os.umask(0)
+      os.umask(umask)
+      os.chmod(fp.name, 0o666 & ~umask)
+    if not backup is None and nlink > 0: make_backup(f, backup, nlink)
+    if nlink > 1:
+      shutil.copyfile(fp.name, target)
+      os.remove(fp.name)
+    else:
+      os.replace(fp.name, target)
+  except:
+    if os.path.exists(fp.name): os.remove(fp.name)
+    raise
+
+def same_text(f, txt):
+  '''Compare a file with a string
+
+  :param str f: file to compare
+  :param str txt: text to compare with
+  :returns bool: True if `f` exists and contains exactly `txt`
+
+  The file is read in chunks, stopping at the first difference.
+  '''
+  try:
+    with open(f,'r') as fp:
+      i = 0
+      while True:
+        chunk = fp.read(CHUNK_SIZE)
+        if chunk == '': return i == len(txt)
+        if txt[i:i+len(chunk)] != chunk: return False
+        i += len(chunk)
+  except (OSError, UnicodeDecodeError):
+    return False
+
+def write_text(f, txt, backup = None):
+  '''Replace the contents of a file with a string
+
+  :param str f: file to write
+  :param str txt: new contents
+  :param str|None backup: (Optional) backup file name
+  '''
+  fp = open_temp(f)
+  try:
+    fp.write(txt)
+  except:
+    fp.close()
+    os.remove(fp.name)
+    raise
+  commit(f, fp, backup)
@@ -11,6 +11,17 @@ import os
 import fnmatch
 import re
 import sys
+import inspect
+import codecs
+import locale
+import json
+import time
+import hashlib
+import stat
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import fupdate
 
 #
 # FWalkTree
@@ -35,47 +46,515 @@ cf = {
   'follow-symlinks': False,
   'pattern-test': False,
   'report-binary': True,
+  'dump-stack': False,
+  'walk-threads': 1,
+  'walk-source': 'fs',
+  'ignore-files': [],
+  'exclude-files': {},
 }
 '''Global config settings'''
 
 DEF_PATTERN_DIRCFG = '.binderrc'
 '''Default per-directory exclude patterns file'''
 CHUNK_SIZE = 4096
-'''When matching content, read this many characters'''
+'''When matching content, read this many bytes (default)'''
+RE_CHUNK_SIZE = re.compile(r'^!CHUNK_SIZE=(\d+)!$')
+'''Regular expression matching the rule that sets the content chunk size'''
+ENCODING = locale.getpreferredencoding(False)
+'''Encoding used to decode file contents for content rules'''
 VISITED_DIRS = dict()
-'''Used to prevent infinite loops when following symlinks'''
+'''Used to prevent infinite loops when following symlinks, keyed by `(st_dev, st_ino)`'''
+COMPILED = {}
+'''Filter tables compiled by `compiled_filters`, keyed by the `id` of the rule lists they were compiled from'''
+COMPILED_MAX = 256
+'''Maximum number of compiled filter tables kept'''
+FILTER_LAYERS = []
+'''Rules of the per-directory config files in effect while walking, as `(rules, reset)`, outermost first'''
+FILTER_CURRENT = {
+  'cli-filter': None,
+  'filter': None,
+  'sizes': None,
+  'state': None,
+}
+'''Filter state last returned by `filter_state`, and the rule lists it depends on.  Cleared when `FILTER_LAYERS` changes'''
+DIRCFG_CACHE = {}
+'''Parsed per-directory config files by path, with their `(mtime_ns, size)` (See `parse_filtercfg`)'''
+DIRCFG_RULES = {}
+'''Parsed per-directory config files by contents'''
+IGNORE_CACHE = {}
+'''Parsed ignore files by path, with their `(mtime_ns, size)` (See `read_ignore`)'''
+WALK_SOURCES = [ 'fs', 'git', 'git-untracked' ]
+'''Sources of the files to walk (See `iter_tree`)'''
+WALK_INDEX = None
+'''Directory index for incremental walks, None if not enabled (See `load_walk_index`)'''
+WALK_INDEX_VERSION = 2
+'''Version of the walk index format'''
+WALK_INDEX_RACY_NS = 2000000000
+'''Directories modified less than this many nanoseconds before being read are not indexed'''
+RE_TRANSLATE_GROUP = re.compile(r'\(\?P([<=])g(\d+)')
+'''Regular expression matching the named groups used by `fnmatch.translate`'''
+
+def rule_regex(pat, n):
+  '''Convert a file name wildcard rule into a regular expression
+
+  :param str pat: wildcard pattern, starting with `/` to match the full path
+  :param int n: rule number, used to make group names unique
+  :returns str: regular expression matching `name + "\\0" + path`
+
+  Full path patterns skip the base name, while base name patterns
+  must be followed by the NUL separator.
+  '''
+  if pat.startswith('/'):
+    rx = '[^\x00]*\x00' + fnmatch.translate(pat[1:])
+  else:
+    rx = fnmatch.translate(pat)
+    if rx.endswith('\\Z'): rx = rx[:-2]
+    rx += '\x00'
+  return RE_TRANSLATE_GROUP.sub(lambda mv: '(?P{op}r{n}g{g}'.format(op=mv.group(1), n=n, g=mv.group(2)), rx)
+
+def combine_content_rules(pats):
+  '''Combine content rules in a single regular expression
+
+  :param list pats: compiled regular expressions with the same outcome
+  :returns list: regular expressions to search for
+
+  Since a match of any of the rules has the same result, which one
+  matched is not relevant.  Rules with groups (which could be back
+  referenced) or that fail to compile together are kept separate.
+  '''
+  simple = [ pat for pat in pats if pat.groups == 0 and pat.flags == pats[0].flags ]
+  if len(simple) < 2: return pats
+  try:
+    combined = re.compile('|'.join('(?:{rx})'.format(rx=pat.pattern) for pat in simple), pats[0].flags)
+  except re.error:
+    return pats
+  return [ combined ] + [ pat for pat in pats if not pat in simple ]
+
+def compile_rules(*rulesets):
+  '''Compile filter tables
+
+  :param list rulesets: lists of `(pattern, op)` filter rules, in priority order
+  :returns dict: compiled tables for directories (`D`) and files (`F`)
 
-def filter_file(f,name=None):
+  Each table is a list of steps, to be tried in order:
+
+  - `('N', regex, ops, None)` : consecutive wildcard rules combined in a
+    single regular expression with one named group per rule.  `ops`
+    maps group names to the rule `op`.
+  - `('C', regex, op, chunk)` : consecutive content rules (`FC+` or `FC-`)
+    with the same `op`, combined when possible (See `combine_content_rules`).
+    `chunk` is the number of bytes of the file to search.
+
+  As the alternatives of a regular expression are tried in order,
+  the group that matched is the first rule that matches, the same
+  as when the rules are checked one by one.
+
+  Content rules use `CHUNK_SIZE` bytes, unless the rule set contains
+  a `!CHUNK_SIZE=n!` rule, which applies to the content rules after it.
+  The `F` table also has a `chunk` entry with the largest chunk size
+  used.
+  '''
+  tables = { 'F-chunk': 0 }
+  for kind in ('D', 'F'):
+    steps = []
+    n = 0
+    for rules in rulesets:
+      chunk = CHUNK_SIZE
+      alts = []
+      ops = {}
+      for pat, op in rules:
+        n += 1
+        if op == 'CHUNK':
+          chunk = pat
+          continue
+        if op[0] in 'DF' and op[0] != kind: continue
+        if op.startswith('FC'):
+          if len(alts):
+            steps.append(('N', re.compile('|'.join(alts)), ops, None))
+            alts = []
+            ops = {}
+          if len(steps) and steps[-1][0] == 'C' and steps[-1][2] == op and steps[-1][3] == chunk:
+            steps[-1][1].append(pat)
+          else:
+            steps.append(('C', [ pat ], op, chunk))
+          continue
+        alts.append('(?P<r{n}>{rx})'.format(n=n, rx=rule_regex(pat, n)))
+        ops['r{n}'.format(n=n)] = op
+      if len(alts): steps.append(('N', re.compile('|'.join(alts)), ops, None))
+
+    tables[kind] = []
+    for step in steps:
+      if step[0] == 'C':
+        tables['F-chunk'] = max(tables['F-chunk'], step[3])
+        for pat in combine_content_rules(step[1]):
+          tables[kind].append(('C', pat, step[2], step[3]))
+      else:
+        tables[kind].append(step)
+  return tables
+
+def read_head(f, size):
+  '''Read the beginning of a file for content rules
+
+  :param str f: file to read
+  :param int size: number of bytes to read
+  :returns bytes|None: the first `size` bytes of `f`, None if it looks like a binary file
+
+  Files containing NUL bytes, or that can not be decoded, are
+  considered binary.
+  '''
+  with open(f,'rb') as fp:
+    head = fp.read(size)
+  if b'\0' in head: return None
+  return head
+
+def decode_head(head):
+  '''Decode the beginning of a file
+
+  :param bytes head: file contents, possibly truncated in the middle of a character
+  :returns str|None: decoded text, None if it can not be decoded
+  '''
+  try:
+    return codecs.getincrementaldecoder(ENCODING)().decode(head)
+  except UnicodeDecodeError:
+    return None
+
+def filter_state():
+  '''Get the filter rules in effect and their compiled tables
+
+  :returns dict: `rulesets`, their `sizes`, compiled `tables` and `signature`
+
+  The rules in effect are `cf['cli-filter']`, then the rules of the
+  per-directory config files in `FILTER_LAYERS` (innermost first, up
+  to a file with `!RESET!`), then `cf['filter']`.  Each combination
+  is compiled once, and again only if a rule list grows.
+  '''
+  cur = FILTER_CURRENT
+  sizes = (len(cf['cli-filter']), len(cf['filter']))
+  if cur['filter'] is cf['filter'] and cur['cli-filter'] is cf['cli-filter'] \
+        and cur['sizes'] == sizes and not cur['state'] is None:
+    return cur['state']
+
+  rulesets = [ cf['cli-filter'] ]
+  for rules, reset in reversed(FILTER_LAYERS):
+    rulesets.append(rules)
+    if reset: break
+  else:
+    rulesets.append(cf['filter'])
+  # The entry keeps the rule lists alive, so their ids are not re-used
+  key = tuple(id(rules) for rules in rulesets)
+  rsizes = tuple(len(rules) for rules in rulesets)
+  state = COMPILED.get(key)
+  if state is None or state['sizes'] != rsizes:
+    if len(COMPILED) >= COMPILED_MAX: COMPILED.clear()
+    state = {
+      'rulesets': rulesets,
+      'sizes': rsizes,
+      'tables': compile_rules(*rulesets),
+      'signature': None,
+    }
+    COMPILED[key] = state
+  cur['cli-filter'] = cf['cli-filter']
+  cur['filter'] = cf['filter']
+  cur['sizes'] = sizes
+  cur['state'] = state
+  return state
+
+def push_filter_layer(rules, reset):
+  '''Add the rules of a per-directory config file
+
+  :param list rules: rules from `parse_filtercfg`
+  :param bool reset: True if the rules replace `cf['filter']` and the outer layers
+  '''
+  FILTER_LAYERS.append((rules, reset))
+  FILTER_CURRENT['state'] = None
+
+def pop_filter_layers(n):
+  '''Remove per-directory config file rules
+
+  :param int n: number of layers to keep
+  '''
+  if len(FILTER_LAYERS) > n:
+    del FILTER_LAYERS[n:]
+    FILTER_CURRENT['state'] = None
+
+def compiled_filters():
+  '''Get the compiled filter tables
+
+  :returns dict: compiled tables as returned by `compile_rules`
+
+  See `filter_state`.
+  '''
+  return filter_state()['tables']
+
+def rules_signature():
+  '''Identify the filter rules in effect
+
+  :returns str: hash of the rules in effect (See `filter_state`)
+
+  Used to check if filter verdicts saved in the walk index are
+  still valid.  Rules matching paths depend on where the walk
+  started, so verdicts are also saved with the walk relative path
+  of their directory (See `iter_tree`).
+  '''
+  state = filter_state()
+  if state['signature'] is None:
+    state['signature'] = hashlib.sha1(repr(state['rulesets']).encode()).hexdigest()
+  return state['signature']
+
+def ignore_regex(pat):
+  '''Translate a gitignore pattern into a regular expression
+
+  :param str pat: pattern, without the `!` and trailing `/` markers
+  :returns str: regular expression matching paths relative to the ignore file directory
+
+  Follows the `gitignore` rules:
+
+  - `*` and `?` do not match `/`, `[...]` matches a character class.
+  - A leading `**/` matches in all directories, a trailing `/**`
+    matches everything inside, and `/**/` matches zero or more
+    directories.
+  - Patterns with a `/` (other than at the end) are relative to the
+    ignore file directory, otherwise they match at any level.
+  - `\\` escapes the next character.
+  '''
+  anchored = '/' in pat
+  if pat.startswith('/'): pat = pat[1:]
+  res = ''
+  i = 0
+  while i < len(pat):
+    c = pat[i]
+    if pat.startswith('**', i) and (i == 0 or pat[i-1] == '/') and (i+2 == len(pat) or pat[i+2] == '/'):
+      if i+2 == len(pat):
+        res += '.*'
+        i += 2
+      else:
+        res += '(?:.*/)?'
+        i += 3
+      continue
+    if c == '*':
+      res += '[^/]*'
+    elif c == '?':
+      res += '[^/]'
+    elif c == '\\' and i+1 < len(pat):
+      i += 1
+      res += re.escape(pat[i])
+    elif c == '[':
+      j = i+1
+      if j < len(pat) and pat[j] in '!^': j += 1
+      if j < len(pat) and pat[j] == ']': j += 1
+      while j < len(pat) and pat[j] != ']': j += 1
+      if j >= len(pat):
+        res += '\\['
+      else:
+        body = pat[i+1:j].replace('\\','\\\\')
+        if body[0] == '!': body = '^' + body[1:]
+        res += '[' + body + ']'
+        i = j
+    else:
+      res += re.escape(c)
+    i += 1
+  if not anchored: res = '(?:.*/)?' + res
+  return res
+
+def read_ignore(ifile):
+  '''Read a gitignore style file
+
+  :param str ifile: ignore file
+  :returns dict|None: compiled rules, None if `ifile` is not a file or has no rules
+
+  Rules are compiled into one regular expression for directories
+  (`D`) and one for files (`F`), with the rules in reverse order so
+  that the last matching rule is the one found.  `neg` maps the
+  group of each rule to True for negated (`!`) rules.  Parsed files
+  are cached, and only read again if they change.
+  '''
+  try:
+    st = os.stat(ifile)
+  except OSError:
+    return None
+  sig = (st.st_mtime_ns, st.st_size)
+  if ifile in IGNORE_CACHE and IGNORE_CACHE[ifile][0] == sig: return IGNORE_CACHE[ifile][1]
+
+  rules = []
+  try:
+    with open(ifile,'r') as fp:
+      for ln in fp:
+        ln = ln.rstrip('\r\n')
+        if ln.endswith(' ') and not ln.endswith('\\ '): ln = ln.rstrip(' ')
+        if ln == '' or ln[0] == '#': continue
+        neg = ln[0] == '!'
+        if neg: ln = ln[1:]
+        dironly = ln.endswith('/')
+        ln = ln.rstrip('/')
+        if ln == '': continue
+        rules.append((ignore_regex(ln), neg, dironly))
+  except (OSError, UnicodeDecodeError) as err:
+    sys.stderr.write('{file}: {err}\n'.format(file=ifile, err=str(err)))
+    return None
+
+  res = None
+  if len(rules):
+    res = { 'D': None, 'F': None, 'neg': {} }
+    for kind in ('D', 'F'):
+      alts = []
+      for n in range(len(rules)-1, -1, -1):
+        rx, neg, dironly = rules[n]
+        if dironly and kind == 'F': continue
+        alts.append('(?P<i{n}>{rx})'.format(n=n, rx=rx))
+        res['neg']['i{n}'.format(n=n)] = neg
+      if len(alts): res[kind] = re.compile('|'.join(alts), re.DOTALL)
+  IGNORE_CACHE[ifile] = (sig, res)
+  return res
+
+def ignored(ignores, f, isdir):
+  '''Check a path against gitignore style rules
+
+  :param list ignores: `(prefix, rules)` for the ignore files in effect, outermost first
+  :param str f: path to check
+  :param bool isdir: True if `f` is a directory
+  :returns bool: True if `f` is ignored
+
+  Rules of deeper ignore files take precedence, and within a file
+  the last matching rule decides (as in `gitignore`).  `prefix` is
+  removed from `f` to get the path relative to the ignore file.
+  '''
+  for prefix, rules in reversed(ignores):
+    pat = rules['D' if isdir else 'F']
+    if pat is None: continue
+    mv = pat.fullmatch(f[len(prefix):])
+    if mv: return not rules['neg'][mv.lastgroup]
+  return False
+
+def push_dir_rules(prefix, names, ignores):
+  '''Apply the per-directory config and ignore files of a directory
+
+  :param str prefix: directory path, with a trailing `/` (empty for the current directory)
+  :param set|None names: names in the directory, checked on the file system if None
+  :param list ignores: `(prefix, rules)` list (See `ignored`), receives the ignore files rules
+
+  The per-directory config file rules are pushed to `FILTER_LAYERS`.
+  '''
+  def found(name):
+    return name in names if not names is None else os.path.isfile(prefix + name)
+
+  if cf['pattern-dircfg'] and found(cf['pattern-dircfg']):
+    rules, reset = parse_filtercfg(prefix + cf['pattern-dircfg'])
+    if len(rules) or reset: push_filter_layer(rules, reset)
+
+  for i in cf['ignore-files']:
+    if not found(i): continue
+    rules = read_ignore(prefix + i)
+    if not rules is None: ignores.append((prefix, rules))
+
+def push_parent_rules(top, f, ignores):
+  '''Apply the rules of the directories above a path
+
+  :param str top: walk top directory
+  :param str f: path below `top`, built from `top`
+  :param list ignores: receives the ignore files rules (See `push_dir_rules`)
+  :returns bool: True if a directory between `top` and `f` is filtered out
+
+  Pushes the per-directory config and ignore files rules of `top` and
+  every directory down to the parent of `f`, as `iter_tree` does when
+  walking `top`.  The caller must pop the layers.
+  '''
+  rel = os.path.relpath(f, top)
+  if rel == '.' or rel == '..' or rel.startswith('../'): return False
+  names = rel.split('/')
+  d = top.rstrip('/')
+  for n, name in enumerate(names):
+    prefix = f'{d}/'
+    if prefix[:2] == './': prefix = prefix[2:]
+    push_dir_rules(prefix, None, ignores)
+    if n == len(names) - 1: break
+    d = prefix + name
+    if len(ignores) and ignored(ignores, d, True): return True
+    if filter_file(d, name, True): return True
+  return False
+
+def filter_path(f, top, isdir = None):
+  '''Filter a path found below a walk top directory
+
+  :param str f: path to filter, built from `top`
+  :param str top: walk top directory
+  :param bool|None isdir: (Optional) True if `f` is a directory, checked if not given
+  :returns bool: True if the path needs to be filtered, False if it should be processed
+
+  Gives the same verdict as walking `top` with `iter_tree`: the
+  rules of the directories between `top` and `f` apply, and `f` is
+  filtered out if one of them is (See `push_parent_rules`).
+  '''
+  if isdir is None: isdir = os.path.isdir(f)
+  if not isdir and excluded(f): return True
+  olayers = len(FILTER_LAYERS)
+  ignores = []
+  try:
+    if push_parent_rules(top, f, ignores): return True
+    if len(ignores) and ignored(ignores, f, isdir): return True
+    return filter_file(f, isdir = isdir)
+  finally:
+    pop_filter_layers(olayers)
+
+def itrc():
+  '''Dump a inspect trace
+
+  :returns str: inspect trace text
+
+  This function is meant to run from an exception handler, to
+  display the current stack trace for debugging.
+  '''
+  if not cf['dump-stack']: return ''
+  txt=''
+  for fr in inspect.trace():
+    txt += ' >> {filename},{line}:{fn} "{context}"\n'.format(
+            filename = fr.filename,
+            line = fr.lineno,
+            fn = fr.function,
+            context = fr.code_context[fr.index].strip('\r\n'))
+  return txt
+
+def filter_file(f,name=None,isdir=None):
   '''Apply file filters
 
   :param str f: file path to filter
   :param str name: base name of the file (without directory path)
+  :param bool|None isdir: (Optional) True if `f` is a directory, checked if not given
   :returns bool: True if the file needs to be filtered, False if it should be processed
 
   Filter file names/paths using the filter as defined in the `cf['cli-filter']`
-  and `cf['filter']` global configuration variables.
+  and `cf['filter']` global configuration variables, and the per-directory
+  config files in effect (See `filter_state`).  The first matching rule
+  decides (See `compile_rules`).
+
+  Content rules share a single read of the beginning of the file.
+  Binary files are never matched by content rules.
   '''
   if name is None: name = os.path.basename(f)
 
-  isdir = os.path.isdir(f)
-  for pat,op in cf['cli-filter'] + cf['filter']:
-    if op[0] == 'D' and (not isdir): continue # Dir only patterns...
-    if op[0] == 'F' and isdir: continue # File only patterns...
+  if isdir is None: isdir = os.path.isdir(f)
+  tables = compiled_filters()
+  subject = None
+  head = None
+  texts = {}
+  for step, pat, op, chunk in tables['D' if isdir else 'F']:
+    if step == 'N':
+      # File name wildcard check
+      if subject is None: subject = name + '\x00' + f
+      mv = pat.match(subject)
+      if mv: return op[mv.lastgroup][-1] == '-'
+      continue
 
-    if op.startswith('FC'):
-      # This is a file content check
-      try:
-        with open(f,'r') as fp:
-          txt = fp.read(CHUNK_SIZE)
-          if pat.search(txt): return op[-1] == '-'
-      except UnicodeDecodeError:
+    # This is a file content check
+    if head is None:
+      head = read_head(f, tables['F-chunk'])
+      if not head is None:
+        texts[tables['F-chunk']] = decode_head(head)
+      if head is None or texts[tables['F-chunk']] is None:
         if cf['report-binary']:
-          sys.stderr.write(f'{sfile}: Unprocessed binary file\n')
+          sys.stderr.write(f'{f}: Unprocessed binary file\n')
         return False
-    else:
-      # File name wildcard check
-      if fnmatch.fnmatch(f,pat[1:]) if pat[0] == '/' else fnmatch.fnmatch(name,pat):
-        return op[-1] == '-'
+    if not chunk in texts: texts[chunk] = decode_head(head[:chunk])
+    if pat.search(texts[chunk]): return op[-1] == '-'
   return False
 
 def add_filter_rule(ln,filterid):
@@ -104,7 +583,16 @@ def add_filter_rule(ln,filterid):
      the file contents.
 
   If a file/directory name match starts with `/`, it matches the
-  full path, otherwise it tests only against the base name.
+  full path, otherwise it tests only against the base name.  Matches
+  use `fnmatch` wildcards, so `*` also matches `/` in full path
+  matches.  Full paths are relative to the walk top directory, also
+  for rules from per-directory config files.
+
+  These rules keep their first match semantics.  For gitignore style
+  rules (negation, `**`, patterns anchored to the directory of the
+  file defining them) use per-directory ignore files (See
+  `read_ignore`), which are checked first and prune ignored
+  directories before the rules here are tried.
 
   For FC rules, the DOTALL and IGNORECASE flags are used by default.
   You can use inline syntax notation to change these settings.  Examples:
@@ -132,7 +620,22 @@ def add_filter_rule(ln,filterid):
   **TIP:** `.*` is greedy by default.  Use `.*?` for non greedy
   wildcard match.
 
+  Content rules search the first `CHUNK_SIZE` bytes of a file.  This
+  can be changed for the content rules that follow with:
+
+  `!CHUNK_SIZE=bytes!`
+
   '''
+  cf[filterid].append(parse_filter_rule(ln))
+
+def parse_filter_rule(ln):
+  '''Parse a filter specification
+
+  :param str ln: Filter rule specification (See `add_filter_rule`)
+  :returns tuple: `(pattern, op)` filter rule
+  '''
+  mv = RE_CHUNK_SIZE.match(ln)
+  if mv: return ( int(mv.group(1)), 'CHUNK' )
   rule = ( ln, '+' )
   for prefix in [ 'D+', 'D-', 'F+', 'F-', '+', '-' , 'FC+', 'FC-']:
     if ln.startswith(prefix):
@@ -142,7 +645,45 @@ def add_filter_rule(ln,filterid):
       else:
         rule = ( ln[len(prefix):] , prefix)
       break
-  cf[filterid].append(rule)
+  return rule
+
+def parse_filtercfg(cfgfile):
+  '''Parse a filter configuration file
+
+  :param str cfgfile: file name of configuration file to read
+  :returns tuple: `(rules, reset)` where `reset` is True if the file contains `!RESET!`
+
+  Only the rules after the last `!RESET!` are returned.  Parsed files
+  are cached, and only read again if they change.  Files with the
+  same contents share the same rule list, so that their compiled
+  tables are shared too.  The returned rule list must not be modified.
+  '''
+  st = os.stat(cfgfile)
+  sig = (st.st_mtime_ns, st.st_size)
+  if cfgfile in DIRCFG_CACHE and DIRCFG_CACHE[cfgfile][0] == sig: return DIRCFG_CACHE[cfgfile][1]
+
+  with open(cfgfile,'r') as fp:
+    txt = fp.read()
+  if txt in DIRCFG_RULES:
+    DIRCFG_CACHE[cfgfile] = (sig, DIRCFG_RULES[txt])
+    return DIRCFG_RULES[txt]
+
+  reset = False
+  nfilter = []
+  for ln in txt.splitlines():
+    ln = ln.strip()
+    if ln == '' or ln[0] == '#': continue
+    if ln == '!RESET!':
+      reset = True
+      nfilter = []
+      continue
+    nfilter.append(parse_filter_rule(ln))
+  # A chunk size set in this file does not apply to rules from elsewhere
+  if any(op == 'CHUNK' for pat, op in nfilter): nfilter.append(( CHUNK_SIZE, 'CHUNK' ))
+
+  DIRCFG_RULES[txt] = (nfilter, reset)
+  DIRCFG_CACHE[cfgfile] = (sig, DIRCFG_RULES[txt])
+  return (nfilter, reset)
 
 def read_filtercfg(cfgfile,filter='filter'):
   '''Defines filters from configuration file
@@ -151,19 +692,12 @@ def read_filtercfg(cfgfile,filter='filter'):
   :param str filter: type of filter to load.  `filter` if not specified
 
   Loads a filter specification from file.  The `cf[filter]` global
-  configuration is updated.
+  configuration is updated.  Rules read into `filter` take precedence
+  over the existing ones, rules read into `cli-filter` come after the
+  existing ones.  A `!RESET!` line drops the existing rules.
   '''
-  cfilter = list(cf[filter])
-  nfilter = []
-  with open(cfgfile,'r') as fp:
-    for ln in fp:
-      ln = ln.strip()
-      if ln == '' or ln[0] == '#': continue
-      if ln == '!RESET!':
-        cfilter = []
-        nfilter = []
-        continue
-      add_filter_rule(ln,filter)
+  nfilter, reset = parse_filtercfg(cfgfile)
+  cfilter = [] if reset else cf[filter]
 
   if filter == 'filter':
     cf[filter] = nfilter + cfilter
@@ -171,67 +705,485 @@ def read_filtercfg(cfgfile,filter='filter'):
     cf[filter] = cfilter + nfilter
 
 
-def walktree(dirname, lamb):
+def exclude_file(f):
+  '''Never walk a file
+
+  :param str f: file path
+
+  Used for the caches kept by the programs walking the tree (i.e.
+  a manifest in the current directory), so that they are not
+  processed as sources.  Excluded files are kept in
+  `cf['exclude-files']` by base name, so other files only cost a
+  set look-up.
+  '''
+  cf['exclude-files'].setdefault(os.path.basename(f), set()).add(os.path.abspath(f))
+
+def excluded(f):
+  '''Check if a file was excluded from walks
+
+  :param str f: file path
+  :returns bool: True if `f` was excluded with `exclude_file`
+  '''
+  name = os.path.basename(f)
+  return name in cf['exclude-files'] and os.path.abspath(f) in cf['exclude-files'][name]
+
+def report_error(sfile, err):
+  '''Report an error processing a file
+
+  :param str sfile: file being processed
+  :param Exception err: exception raised
+
+  Meant to run from an exception handler.
+  '''
+  if isinstance(err, UnicodeDecodeError):
+    if cf['report-binary']:
+      sys.stderr.write(f'{sfile}: Unprocessed binary file\n')
+    return
+  sys.stderr.write('{file}: {err} (type: {type})\n{trace}\n'.format(
+                            file=sfile,
+                            err=str(err),
+                            type=type(err),
+                            trace=itrc()))
+
+class IndexEntry:
+  '''Directory entry replayed from the walk index
+
+  :param str dirname: directory containing the entry
+  :param str name: entry name
+  :param bool isdir: True if the entry is a directory
+  :param bool islink: True if the entry is a symlink
+
+  Provides the `os.DirEntry` methods used when walking.
+  '''
+  __slots__ = ('dirname', 'name', 'isdir', 'islink')
+
+  def __init__(self, dirname, name, isdir, islink):
+    self.dirname = dirname
+    self.name = name
+    self.isdir = isdir
+    self.islink = islink
+
+  @property
+  def path(self):
+    return os.path.join(self.dirname, self.name)
+
+  def is_dir(self, *, follow_symlinks = True):
+    return self.isdir and (follow_symlinks or not self.islink)
+
+  def is_file(self, *, follow_symlinks = True):
+    return not self.isdir and (follow_symlinks or not self.islink)
+
+  def is_symlink(self):
+    return self.islink
+
+  def stat(self, *, follow_symlinks = True):
+    return os.stat(self.path, follow_symlinks = follow_symlinks)
+
+  def __fspath__(self):
+    return self.path
+
+def list_dir(dirname):
+  '''Read a directory
+
+  :param str dirname: directory to read
+  :returns tuple: `((st_dev, st_ino), entries, index record)`
+
+  `entries` is a list of `(entry, isdir)` for the files and
+  directories in `dirname`, in directory order.  Symlinks are skipped
+  unless `cf['follow-symlinks']` is set, and "special" files are
+  skipped.  If the directory can not be read, `entries` is the
+  exception raised, so that the directory can be marked as visited
+  before the error is reported.
+
+  If the walk index is enabled, directories whose modification time
+  did not change are not read, their entries are replayed from the
+  index (as `IndexEntry`).  Otherwise the index record is updated.
+  The index record (or None) is returned, so that filter verdicts
+  can be saved in it.
+
+  Does not depend on the filter rules, so it can run in a worker
+  thread.
+  '''
+  dirname = dirname if dirname != '' else '/'
+  st = os.stat(dirname)
+  key = (st.st_dev, st.st_ino)
+  rec = None
+  if not WALK_INDEX is None:
+    path = os.path.abspath(dirname)
+    WALK_INDEX['seen'].add(path)
+    rec = WALK_INDEX['dirs'].get(path)
+    if not rec is None and rec['stat'] == [ st.st_dev, st.st_ino, st.st_mtime_ns ]:
+      return (key, [ (IndexEntry(dirname, name, isdir, islink), isdir) for name, isdir, islink in rec['entries'] ], rec)
+    WALK_INDEX['dirs'].pop(path, None)
+    WALK_INDEX['changed'] = True
+    rec = None
+
+  try:
+    with os.scandir(dirname) as it:
+      subs = list(it)
+  except OSError as err:
+    return (key, err, None)
+  entries = []
+  for de in subs:
+    try:
+      if de.is_symlink() and (not cf['follow-symlinks']): continue # Skipping symlink
+      isdir = de.is_dir()
+      if not (isdir or de.is_file()): continue # Ignore "special" files
+    except OSError:
+      continue
+    entries.append((de, isdir))
+
+  if not WALK_INDEX is None and time.time_ns() - st.st_mtime_ns > WALK_INDEX_RACY_NS:
+    # Recently modified directories may change again within the same timestamp
+    rec = {
+      'stat': [ st.st_dev, st.st_ino, st.st_mtime_ns ],
+      'entries': [ [ de.name, isdir, de.is_symlink() ] for de, isdir in entries ],
+      'rules': None,
+      'prefix': None,
+      'verdicts': None,
+    }
+    WALK_INDEX['dirs'][path] = rec
+    WALK_INDEX['changed'] = True
+  return (key, entries, rec)
+
+def git_files(dirname, untracked = False):
+  '''List the files of a git work tree
+
+  :param str dirname: directory to list
+  :param bool untracked: (Optional) also list untracked files that are not ignored
+  :returns dict|None: `{ directory: { name: isdir } }` with paths relative to `dirname`, None if `dirname` is not in a git work tree
+
+  Files are listed with a single `git ls-files` command.  The
+  top directory is `''`.
+  '''
+  cmd = [ 'git', 'ls-files', '-z', '--cached' ]
+  if untracked: cmd += [ '--others', '--exclude-standard' ]
+  try:
+    res = subprocess.run(cmd, cwd = dirname if dirname != '' else '/',
+                          stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+  tree = { '': {} }
+  for f in res.stdout.split(b'\0'):
+    if len(f) == 0: continue
+    parts = os.fsdecode(f).split('/')
+    d = ''
+    for i in parts[:-1]:
+      sub = i if d == '' else d + '/' + i
+      if not sub in tree:
+        tree[d][i] = True
+        tree[sub] = {}
+      d = sub
+    tree[d].setdefault(parts[-1], False)
+  return tree
+
+def list_git_dir(tree, top, dirname):
+  '''Read a directory from a git file list
+
+  :param dict tree: file list from `git_files`
+  :param str top: directory `tree` was listed from
+  :param str dirname: directory to read
+  :returns tuple: same as `list_dir`
+
+  Directories are not read.  Files are checked with `lstat`, to skip
+  files that were deleted, symlinks (unless `cf['follow-symlinks']`
+  is set) and anything that is not a regular file.  Symlinks to
+  directories and submodules are not entered.
+  '''
+  dirname = dirname if dirname != '' else '/'
+  rel = os.path.relpath(dirname, top)
+  entries = []
+  for name, isdir in tree.get('' if rel == '.' else rel, {}).items():
+    de = IndexEntry(dirname, name, isdir, False)
+    if not isdir:
+      try:
+        st = os.lstat(de.path)
+        if stat.S_ISLNK(st.st_mode):
+          if not cf['follow-symlinks']: continue # Skipping symlink
+          de.islink = True
+          st = os.stat(de.path)
+      except OSError:
+        continue
+      if not stat.S_ISREG(st.st_mode): continue
+    entries.append((de, isdir))
+  return (('git', os.path.abspath(dirname)), entries, None)
+
+def iter_tree(dirname, batch = None, onerror = None, threads = None, source = None, top = None):
+  '''Iterate over a directory tree
+
+  :param str dirname: Directory to walk
+  :param int|None batch: (Optional) yield lists of up to `batch` records
+  :param function|None onerror: (Optional) function called as `onerror(path, err)` when a sub-directory can not be read
+  :param int|None threads: (Optional) threads used to read directories, defaults to `cf['walk-threads']`
+  :param str|None source: (Optional) `fs`, `git` or `git-untracked`, defaults to `cf['walk-source']`
+  :param str|None top: (Optional) walk top directory, when `dirname` is a directory found walking it
+  :yields tuple: `(path, entry, verdict)` records (or lists of them if `batch` is given)
+
+  Files and directories are yielded in the same depth first order
+  as `walktree` visits them.  `entry` is the `os.DirEntry` and
+  `verdict` is the result of `filter_file` (True if filtered out).
+  Directories are yielded before their contents, and only entered
+  if not filtered out.
+
+  The tree is walked with an explicit stack, so deep trees do not
+  hit the recursion limit.  The rules of the per-directory config
+  file (`cf['pattern-dircfg']`) of each directory are pushed to
+  `FILTER_LAYERS` when entering it, and apply to the directory and
+  below (See `filter_state`).  While a record is being handled by
+  the caller, the rules in effect are those of its directory.  They
+  are popped when leaving the directory, or if the iteration is
+  stopped early.
+
+  Errors reading `dirname` are raised.  Errors reading a
+  sub-directory are passed to `onerror`, or raised if not given.
+
+  If the walk index is enabled (See `load_walk_index`), unchanged
+  directories and their filter verdicts are replayed from the index.
+
+  With more than one thread, the sub-directories of a directory
+  are read (See `list_dir`) by a thread pool as soon as the
+  directory is entered, which helps when directory reads have a
+  high latency (i.e. network file systems).  Filters are still
+  applied in the calling thread, so the records and their order
+  are the same as with a single thread.
+
+  Files excluded with `exclude_file` are filtered out, and their
+  verdict is not saved in the walk index.
+
+  Files named in `cf['ignore-files']` (i.e. `.gitignore`) are read
+  as gitignore style rules (See `read_ignore`), which apply to their
+  directory and below.  Ignored entries are filtered out before the
+  filter rules are checked, so an ignored directory costs a single
+  check.
+
+  With a `git` source, the files are listed with `git ls-files` (See
+  `git_files`), adding untracked files that are not ignored with
+  `git-untracked`.  Directories are not read, but the filter rules
+  (and per-directory config files) are applied the same way.  If
+  `dirname` is not in a git work tree, the file system is walked.
+
+  If `top` is given, the per-directory config and ignore files of the
+  directories above `dirname` (up to `top`) also apply (See
+  `push_parent_rules`).  Checking that `dirname` itself is not
+  filtered out is left to the caller.
+  '''
+  if batch:
+    records = []
+    for rec in iter_tree(dirname, onerror = onerror, threads = threads, source = source, top = top):
+      records.append(rec)
+      if len(records) >= batch:
+        yield records
+        records = []
+    if len(records): yield records
+    return
+
+  if threads is None: threads = cf['walk-threads']
+  if source is None: source = cf['walk-source']
+  lister = list_dir
+  if source in ('git', 'git-untracked'):
+    tree = git_files(dirname, source == 'git-untracked')
+    if not tree is None:
+      top = dirname.rstrip('/') if dirname.rstrip('/') != '' else '/'
+      lister = lambda d: list_git_dir(tree, top, d)
+  pool = ThreadPoolExecutor(max_workers = threads) if threads > 1 else None
+  pending = {}
+
+  # Stack of (records, filter layers in effect, ignore files in effect)
+  stack = []
+  olayers = len(FILTER_LAYERS)
+  ignores = []
+
+  def enter(dirname):
+    dirname = dirname.rstrip('/')
+    if dirname in pending:
+      key, entries, rec = pending.pop(dirname).result()
+    else:
+      key, entries, rec = lister(dirname)
+    if key in VISITED_DIRS: return
+    VISITED_DIRS[key] = 1
+    if isinstance(entries, Exception): raise entries
+
+    prefix = f'{dirname}/'
+    if prefix[:2] == './': prefix = prefix[2:]
+    names = set(de.name for de, isdir in entries) if cf['pattern-dircfg'] or len(cf['ignore-files']) else ()
+
+    nlayers = len(FILTER_LAYERS)
+    nignores = len(ignores)
+    push_dir_rules(prefix, names, ignores)
+
+    verdicts = None
+    if not rec is None:
+      sig = rules_signature()
+      # Path rules match the path relative to the walk top directory
+      if rec['rules'] == sig and rec['prefix'] == prefix: verdicts = rec['verdicts']
+      # Content rules depend on the file contents
+      content = compiled_filters()['F-chunk'] > 0
+
+    recs = []
+    fverdicts = []
+    for n, (de, isdir) in enumerate(entries):
+      sfile = f'{dirname}/{de.name}'
+      if sfile[:2] == './': sfile = sfile[2:] # This is not needed but make things nicer looking
+      if de.name in cf['exclude-files'] and not isdir \
+            and os.path.abspath(sfile) in cf['exclude-files'][de.name]:
+        recs.append((sfile, de, True))
+        fverdicts.append(None)
+        continue
+      if len(ignores) and ignored(ignores, sfile, isdir):
+        # Ignored sub-directories are pruned without checking filter rules
+        recs.append((sfile, de, True))
+        fverdicts.append(None)
+        continue
+      if verdicts is None or verdicts[n] is None or (content and not isdir):
+        ftest = filter_file(sfile,de.name,isdir)
+      else:
+        ftest = verdicts[n]
+      recs.append((sfile, de, ftest))
+      fverdicts.append(ftest)
+      if isdir and not ftest and not pool is None:
+        # Read sub-directories ahead of time
+        pending[sfile] = pool.submit(lister, sfile)
+    if not rec is None and fverdicts != verdicts:
+      rec['rules'] = sig
+      rec['prefix'] = prefix
+      rec['verdicts'] = fverdicts
+      WALK_INDEX['changed'] = True
+    recs.reverse()
+    stack.append((recs, nlayers, nignores))
+
+  if not WALK_INDEX is None: WALK_INDEX['roots'].add(os.path.abspath(dirname if dirname != '' else '/'))
+  try:
+    if not top is None: push_parent_rules(top, dirname, ignores)
+    enter(dirname)
+    while len(stack):
+      recs, nlayers, nignores = stack[-1]
+      if not len(recs):
+        # Drop the rules added by this directory
+        pop_filter_layers(nlayers)
+        del ignores[nignores:]
+        stack.pop()
+        continue
+      sfile, de, ftest = recs.pop()
+      yield (sfile, de, ftest)
+      if de.is_dir() and not ftest:
+        try:
+          enter(sfile)
+        except Exception as err:
+          if onerror is None: raise
+          onerror(sfile, err)
+  finally:
+    pop_filter_layers(olayers)
+    if not pool is None: pool.shutdown(wait = False, cancel_futures = True)
+
+def walk_index_options():
+  '''Options the walk index depends on
+
+  :returns dict: options recorded in the walk index
+
+  Filter rules are checked per directory (See `rules_signature`).
+  '''
+  return { 'follow-symlinks': cf['follow-symlinks'] }
+
+def load_walk_index(fname):
+  '''Load the walk index
+
+  :param str fname: walk index file
+
+  Enables incremental walks.  The index keeps, for each directory
+  walked, its modification time, its entries and their filter
+  verdicts.  If the file does not exist, is not valid or was created
+  with different options, an empty index is used.
+  '''
+  global WALK_INDEX
+  WALK_INDEX = {
+    'options': walk_index_options(),
+    'dirs': {},
+    'seen': set(),
+    'roots': set(),
+    'changed': True,
+  }
+  if not os.path.isfile(fname): return
+  try:
+    with open(fname,'r') as fp:
+      data = json.load(fp)
+  except (OSError, ValueError) as err:
+    sys.stderr.write('{file}: {err}\n'.format(file=fname, err=str(err)))
+    return
+  if data.get('version') != WALK_INDEX_VERSION: return
+  if data.get('options') != WALK_INDEX['options']: return
+  WALK_INDEX['dirs'] = data.get('dirs', {})
+  WALK_INDEX['changed'] = False
+
+def save_walk_index(fname):
+  '''Save the walk index
+
+  :param str fname: walk index file
+
+  Directories under the trees walked in this run that were not seen
+  (i.e. were removed) are dropped from the index.  The file is only
+  written if the index changed.
+  '''
+  if WALK_INDEX is None: return
+  roots = [ r.rstrip('/') + '/' for r in WALK_INDEX['roots'] ]
+  dirs = {
+    path: rec for path, rec in WALK_INDEX['dirs'].items()
+    if path in WALK_INDEX['seen'] or not any((path + '/').startswith(r) for r in roots)
+  }
+  if not WALK_INDEX['changed'] and len(dirs) == len(WALK_INDEX['dirs']): return
+  fupdate.write_text(fname, json.dumps({
+    'version': WALK_INDEX_VERSION,
+    'options': WALK_INDEX['options'],
+    'dirs': dirs,
+  }, sort_keys=True))
+
+def walktree(dirname, lamb, dirs = None):
   '''Walk directory tree
 
   :param str dirname: Directory to walk
   :param function lamb: Function to call when a file is found
+  :param dict|None dirs: (Optional) updated with the `st_mtime_ns` of every walked directory
   :returns int: returns a count of failed files.
 
   This function will walk a directory tree, calling the function
-  `lamb` when a suitable file is found.
+  `lamb` when a suitable file is found (See `iter_tree`).
 
-  TODO:Prevent symlink infinite loops
-  '''
-
-  dirname = dirname.rstrip('/')
+  Directories are read with `os.scandir`, so file types come from
+  the directory entries without additional system calls in most
+  cases.  Directories are identified by `(st_dev, st_ino)`, so that
+  each one is visited once even when reached through symlinks.
 
-  if os.path.realpath(dirname) in VISITED_DIRS: return 0
-  VISITED_DIRS[os.path.realpath(dirname)] = 1
+  Directories in `dirs` are keyed by absolute path.  They are stat'ed
+  before being read, so a later change to the modification time
+  shows that files may have been added or removed since the walk.
+  '''
+  rc = 0
+  def onerror(sfile, err):
+    nonlocal rc
+    report_error(sfile, err)
+    if not isinstance(err, UnicodeDecodeError): rc += 1
 
-  if cf['pattern-dircfg']:
-    ofilter = list(cf['filter'])
-    sfile = f'{dir}/{cf["pattern-dircfg"]}'
-    if os.path.isfile(sfile): read_filtercfg(sfile)
+  def mark_dir(d):
+    try:
+      dirs[os.path.abspath(d)] = os.stat(d).st_mtime_ns
+    except OSError:
+      pass
 
-  subs = os.listdir(dirname)
-  rc = 0
-  for i in subs:
-    sfile = f'{dirname}/{i}'
-    if sfile[:2] == './': sfile = sfile[2:] # This is not needed but make things nicer looking
-    if os.path.islink(sfile) and (not cf['follow-symlinks']): continue # Skipping symlink
-    if not (os.path.isfile(sfile) or os.path.isdir(sfile)): continue # Ignore "special" files
-
-    ftest = filter_file(sfile,i)
-    isdir = os.path.isdir(sfile)
+  if not dirs is None: mark_dir(dirname if dirname != '' else '/')
+  for sfile, de, ftest in iter_tree(dirname, onerror = onerror):
+    if not dirs is None and not ftest and de.is_dir(): mark_dir(sfile)
     if cf['pattern-test']:
-
       print('PATTERN:{file}{isdir} - {yesno}'.format(file=sfile,
-                                isdir='/' if isdir else '',
+                                isdir='/' if de.is_dir() else '',
                                 yesno='FILTERED' if ftest else 'PROCESS'))
-      if isdir and not ftest: walktree(sfile,lamb)
       continue
 
-    if ftest: continue
+    if ftest or de.is_dir(): continue
 
     try:
-      if isdir:
-        walktree(sfile,lamb)
-      else:
-        lamb(sfile)
-    except UnicodeDecodeError:
-      if cf['report-binary']:
-        sys.stderr.write(f'{sfile}: Unprocessed binary file\n')
+      lamb(sfile)
     except Exception as err:
-      sys.stderr.write('{file}: {err} (type: {type})\n{trace}\n'.format(
-                                file=sfile,
-                                err=str(err),
-                                type=type(err),
-                                trace=itrc()))
-      rc += 1
-
-  if cf['pattern-dircfg']: # Restore previous filter config
-    cf['filter'] = ofilter
+      onerror(sfile, err)
 
   return rc
 
@@ -255,6 +1207,13 @@ def apply_cli_opts(ns):
   cf['follow-symlinks'] = ns.follow_symlinks
   cf['pattern-test'] = ns.pattern_test
   cf['report-binary'] = ns.report_binary
+  cf['dump-stack'] = getattr(ns, 'dump_stack', False)
+  cf['walk-threads'] = max(1, getattr(ns, 'walk_threads', 1))
+  cf['walk-source'] = getattr(ns, 'walk_source', 'fs')
+  cf['ignore-files'] = getattr(ns, 'walk_ignore', None) or []
+  if getattr(ns, 'walk_index', None):
+    load_walk_index(ns.walk_index)
+    exclude_file(ns.walk_index)
 
 if __name__ == '__main__':
   from argparse import ArgumentParser, Action
@@ -267,9 +1226,13 @@ if __name__ == '__main__':
   cli.add_argument('--pattern-dircfg', help='Per-directory config file', nargs='?', const='.binderrc', default=DEF_PATTERN_DIRCFG)
   cli.add_argument('--reset-std-patterns', help='Reset built-in patterns', action='store_true')
   cli.add_argument('--pattern-file', help='Read patterns from file', action='append')
-  cli.add_argument('--pattern', help='Add pattern rule', action='append')
+  cli.add_argument('--pattern', help='Add pattern rule (fnmatch wildcards, first match wins)', action='append')
   cli.add_argument('--pattern-test', help='Test pattern rules', action='store_true')
   cli.add_argument('--report-binary', help='Show detected binary files', action='store_true')
+  cli.add_argument('--walk-threads', help='Threads used to read directories', type=int, default=1)
+  cli.add_argument('--walk-index', help='Keep an index of walked directories in file between runs')
+  cli.add_argument('--walk-source', help='List files from the file system or from git', choices=WALK_SOURCES, default='fs')
+  cli.add_argument('--walk-ignore', help='Per-directory gitignore style file (i.e. .gitignore)', action='append')
   cli.add_argument('file', help='File/directories to process', nargs='*')
 
   opts = cli.parse_args()
@@ -285,6 +1248,7 @@ if __name__ == '__main__':
         walktree(f,process)
       else:
         print(f'{f} is not a directory')
+    if opts.walk_index: save_walk_index(opts.walk_index)
   else:
     print('No directories specified')
 
@@ -0,0 +1,224 @@
+#!/usr/bin/atf-sh
+
+
+
+###$_end-include
+#
+# Unit testing
+#
+[ -n "${IN_COMMON:-}" ] && return
+type atf_get_srcdir >/dev/null 2>&1 || atf_get_srcdir() { pwd; }
+. $(atf_get_srcdir)/testlib/common.sh
+
+fwalktree=$(atf_get_srcdir)/fwalktree.py
+
+pattern_test() {
+  # Sorted verdicts of walking the current directory
+  python3 ../fwalktree.py --pattern-test "$@" . | sed -n -e 's/^PATTERN://p' | sort
+}
+
+xt_syntax() {
+  : =descr "verify syntax..."
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    cp -a "$fwalktree" "$w/fwalktree.py"
+    cd $w
+    python3 -m py_compile fwalktree.py
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Compile test"
+}
+
+xt_filter_rules() {
+  : =descr "first matching filter rule decides"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in fwalktree fupdate ; do
+      cp -a "$(dirname "$fwalktree")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p t/a/b t/build
+    cd t
+    for f in a.sh a.o keep.o a~ a/x.sh a/b/y.sh build/out.sh ; do
+      echo x > $f
+    done
+    printf '#!/bin/sh\n# SECRET\n' > s.sh
+    printf '#!/bin/sh\n\377\376 SECRET\n' > bin.sh
+    printf '#!/bin/sh\n%0100d\nSECRET\n' 0 > late.sh
+
+    pattern_test --pattern=+keep.o --pattern=D-build --pattern='-/a/b/*' \
+		--pattern=FC-SECRET > ../got 2>/dev/null
+    diff -u - ../got <<-_EOF_ || exit 1
+	a.o - FILTERED
+	a.sh - PROCESS
+	a/ - PROCESS
+	a/b/ - PROCESS
+	a/b/y.sh - FILTERED
+	a/x.sh - PROCESS
+	a~ - FILTERED
+	bin.sh - PROCESS
+	build/ - FILTERED
+	keep.o - PROCESS
+	late.sh - FILTERED
+	s.sh - FILTERED
+	_EOF_
+
+    # Content rules only search the first chunk
+    pattern_test --pattern='!CHUNK_SIZE=32!' --pattern=FC-SECRET > ../got 2>/dev/null
+    grep -q '^late.sh - PROCESS$' ../got || exit 1
+    grep -q '^s.sh - FILTERED$' ../got || exit 1
+
+    # Built-in rules can be dropped
+    pattern_test --reset-std-patterns > ../got 2>/dev/null
+    ! grep FILTERED ../got || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Filter rule verdicts"
+}
+
+xt_filter_dircfg() {
+  : =descr "per-directory config files apply to their sub-tree"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in fwalktree fupdate ; do
+      cp -a "$(dirname "$fwalktree")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p t/sub/deep t/other t/reset/in
+    cd t
+    for f in a.sh a.o sub/a.o sub/p.sh sub/deep/x.sh other/x.sh other/a.o \
+		reset/a.o reset/a~ reset/n.txt reset/in/x.sh reset/in/n.txt ; do
+      echo x > $f
+    done
+    printf '#!/bin/sh\n# SECRET\n' > sub/s.sh
+    printf '+*.o\n-/sub/p.sh\nFC-SECRE[T]\nD-deep\n' > sub/.binderrc
+    printf 'F-*.o\n!RESET!\nF-*.txt\n' > reset/.binderrc
+    printf 'F-*.sh\n' > reset/in/.binderrc
+
+    pattern_test > ../got 2>/dev/null
+    diff -u - ../got <<-_EOF_ || exit 1
+	a.o - FILTERED
+	a.sh - PROCESS
+	other/ - PROCESS
+	other/a.o - FILTERED
+	other/x.sh - PROCESS
+	reset/ - PROCESS
+	reset/.binderrc - PROCESS
+	reset/a.o - PROCESS
+	reset/a~ - PROCESS
+	reset/in/ - PROCESS
+	reset/in/.binderrc - PROCESS
+	reset/in/n.txt - FILTERED
+	reset/in/x.sh - FILTERED
+	reset/n.txt - FILTERED
+	sub/ - PROCESS
+	sub/.binderrc - PROCESS
+	sub/a.o - PROCESS
+	sub/deep/ - FILTERED
+	sub/p.sh - FILTERED
+	sub/s.sh - FILTERED
+	_EOF_
+
+    # Command line rules come first
+    pattern_test --pattern=F-a.o > ../got 2>/dev/null
+    grep -q '^sub/a.o - FILTERED$' ../got || exit 1
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Per-directory config verdicts"
+}
+
+xt_walk_ignore() {
+  : =descr "gitignore style rules"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in fwalktree fupdate ; do
+      cp -a "$(dirname "$fwalktree")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p t/node_modules/pkg t/sub t/docs/x/y
+    cd t
+    for f in node_modules/pkg/m.sh a.log keep.log top.sh sub/top.sh sub/a.log \
+		sub/b.log docs/gen.sh docs/x/y/gen.sh docs/x/other.sh ; do
+      echo x > $f
+    done
+    printf 'node_modules/\n*.log\n!keep.log\n/top.sh\ndocs/**/gen.sh\n' > .gitignore
+    printf '!a.log\n' > sub/.gitignore
+
+    pattern_test --walk-ignore .gitignore > ../got 2>/dev/null
+    diff -u - ../got <<-_EOF_ || exit 1
+	.gitignore - PROCESS
+	a.log - FILTERED
+	docs/ - PROCESS
+	docs/gen.sh - FILTERED
+	docs/x/ - PROCESS
+	docs/x/other.sh - PROCESS
+	docs/x/y/ - PROCESS
+	docs/x/y/gen.sh - FILTERED
+	keep.log - PROCESS
+	node_modules/ - FILTERED
+	sub/ - PROCESS
+	sub/.gitignore - PROCESS
+	sub/a.log - PROCESS
+	sub/b.log - FILTERED
+	sub/top.sh - PROCESS
+	top.sh - FILTERED
+	_EOF_
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Ignore file verdicts"
+}
+
+xt_walk_same() {
+  : =descr "same verdicts with walk threads and the walk index"
+
+  w=$(mktemp -d)
+  rc=0
+  (
+    set -euf -o pipefail
+    set -x
+    for m in fwalktree fupdate ; do
+      cp -a "$(dirname "$fwalktree")/$m.py" "$w/$m.py"
+    done
+    cd $w
+    mkdir -p t/sub/deep t/reset t/skip
+    cd t
+    for f in a.sh a.o a.log sub/a.o sub/deep/x.sh reset/a.o reset/n.txt skip/x.sh ; do
+      echo x > $f
+    done
+    printf '+*.o\n' > sub/.binderrc
+    printf '!RESET!\nF-*.txt\n' > reset/.binderrc
+    printf '*.log\nskip/\n' > .gitignore
+    # Directories modified recently are not indexed
+    find . -type d -exec touch -d '1 hour ago' {} +
+
+    set -- --walk-ignore .gitignore --pattern=-/sub/deep/*
+    pattern_test "$@" > ../ref 2>/dev/null
+    grep -q FILTERED ../ref || exit 1
+    pattern_test "$@" --walk-threads 3 > ../got 2>/dev/null
+    diff -u ../ref ../got || exit 1
+    for i in 1 2 ; do
+      pattern_test "$@" --walk-index ../idx > ../got 2>/dev/null
+      diff -u ../ref ../got || exit 1
+    done
+  ) || rc=$?
+  rm -rf "$w"
+  [ $rc -eq 0 ] || atf_fail "Verdicts differ"
+}
+
+xatf_init
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+'''File system watcher
+
+## Description
+
+This module is used to wait for changes in files and directories.
+It uses Linux `inotify` (through `ctypes`) when available, and falls
+back to polling with `os.stat` otherwise.
+
+Both implementations share the same interface:
+
+- `add_dir(dirname)` : watch for changes to files in a directory
+- `add_file(filename)` : watch for changes to a file
+- `wait(timeout)` : wait for changes, returning a set of changed paths
+
+'''
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+'''Events used to detect file changes'''
+
+EVENT_HDR = struct.Struct('iIII')
+'''inotify_event structure header'''
+
+DEF_INTERVAL = 1.0
+'''Default polling interval in seconds'''
+SETTLE_TIME = 0.05
+'''Time to wait for more events after a change is detected'''
+
+class InotifyWatcher:
+  '''Watch files using Linux inotify
+
+  :param float settle: seconds to wait for additional events after a change
+  '''
+  def __init__(self, settle = SETTLE_TIME):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self._add_watch = libc.inotify_add_watch
+    self._add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+    self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    self.settle = settle
+    self.wds = {}
+    self.dirs = {}
+
+  def add_dir(self, dirname):
+    '''Watch for changes to the files in a directory
+
+    :param str dirname: directory to watch
+    '''
+    dirname = os.path.abspath(dirname)
+    if dirname in self.dirs: return
+    wd = self._add_watch(self.fd, os.fsencode(dirname), IN_MASK)
+    if wd < 0: return
+    self.wds[wd] = dirname
+    self.dirs[dirname] = wd
+
+  def add_file(self, filename):
+    '''Watch for changes to a file
+
+    :param str filename: file to watch
+
+    The containing directory is watched, so that files replaced
+    by renaming are also detected.
+    '''
+    self.add_dir(os.path.dirname(os.path.abspath(filename)))
+
+  def _read(self, changed):
+    '''Read pending events
+
+    :param set changed: receives changed paths
+    '''
+    try:
+      data = os.read(self.fd, 65536)
+    except BlockingIOError:
+      return
+    i = 0
+    while i + EVENT_HDR.size <= len(data):
+      wd, mask, cookie, nlen = EVENT_HDR.unpack_from(data, i)
+      i += EVENT_HDR.size
+      name = os.fsdecode(data[i:i+nlen].rstrip(b'\0'))
+      i += nlen
+      if mask & IN_Q_OVERFLOW:
+        # Events were lost, report all watched directories
+        changed.update(self.dirs)
+        continue
+      if not wd in self.wds: continue
+      dirname = self.wds[wd]
+      if mask & IN_IGNORED:
+        del self.dirs[dirname]
+        del self.wds[wd]
+        continue
+      if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or name == '':
+        changed.add(dirname)
+      else:
+        changed.add(os.path.join(dirname, name))
+
+  def wait(self, timeout = None):
+    '''Wait for changes
+
+    :param float|None timeout: seconds to wait, None to wait forever
+    :returns set: changed paths (empty if the timeout expired)
+    '''
+    changed = set()
+    r, w, x = select.select([ self.fd ], [], [], timeout)
+    if len(r) == 0: return changed
+    self._read(changed)
+    # Let the file system settle, editors usually do several operations
+    while len(select.select([ self.fd ], [], [], self.settle)[0]):
+      self._read(changed)
+    return changed
+
+  def close(self):
+    '''Release inotify resources'''
+    if self.fd >= 0: os.close(self.fd)
+    self.fd = -1
+
+class PollWatcher:
+  '''Watch files by polling
+
+  :param float interval: seconds between polls
+  '''
+  def __init__(self, interval = DEF_INTERVAL):
+    self.interval = interval
+    self.files = {}
+    self.dirs = {}
+
+  @staticmethod
+  def _sig(path):
+    try:
+      st = os.stat(path)
+    except OSError:
+      return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+  @staticmethod
+  def _list(dirname):
+    try:
+      return set(os.listdir(dirname))
+    except OSError:
+      return set()
+
+  def add_dir(self, dirname):
+    '''Watch for files added or removed in a directory
+
+    :param str dirname: directory to watch
+    '''
+    dirname = os.path.abspath(dirname)
+    if dirname in self.dirs: return
+    self.dirs[dirname] = (self._sig(dirname), self._list(dirname))
+
+  def add_file(self, filename):
+    '''Watch for changes to a file
+
+    :param str filename: file to watch
+    '''
+    filename = os.path.abspath(filename)
+    if filename in self.files: return
+    self.files[filename] = self._sig(filename)
+
+  def wait(self, timeout = None):
+    '''Wait for changes
+
+    :param float|None timeout: seconds to wait, None to wait forever
+    :returns set: changed paths (empty if the timeout expired)
+    '''
+    start = time.monotonic()
+    while True:
+      changed = set()
+      for dirname, (sig, names) in self.dirs.items():
+        nsig = self._sig(dirname)
+        if nsig == sig: continue
+        nnames = self._list(dirname)
+        changed.add(dirname)
+        changed.update(os.path.join(dirname, n) for n in names ^ nnames)
+        self.dirs[dirname] = (nsig, nnames)
+      for filename, sig in self.files.items():
+        nsig = self._sig(filename)
+        if nsig == sig: continue
+        changed.add(filename)
+        self.files[filename] = nsig
+      if len(changed): return changed
+      if not timeout is None and time.monotonic() - start >= timeout: return changed
+      time.sleep(self.interval)
+
+  def close(self):
+    '''Release resources'''
+    pass
+
+def watcher(interval = DEF_INTERVAL, poll = False):
+  '''Create a file watcher
+
+  :param float interval: polling interval used when inotify is not available
+  :param bool poll: (Optional) force polling
+  :returns InotifyWatcher|PollWatcher: watcher object
+  '''
+  if not poll and sys.platform.startswith('linux'):
+    try:
+      return InotifyWatcher()
+    except (OSError, AttributeError, TypeError):
+      pass
+  return PollWatcher(interval)
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+
+  cli = ArgumentParser(prog='fwatch', description='fwatch test')
+  cli.add_argument('--poll', help='Use polling instead of inotify', action='store_true')
+  cli.add_argument('--interval', help='Polling interval', type=float, default=DEF_INTERVAL)
+  cli.add_argument('path', help='Files/directories to watch', nargs='+')
+  opts = cli.parse_args()
+
+  w = watcher(opts.interval, opts.poll)
+  print('Using {}'.format(type(w).__name__))
+  for p in opts.path:
+    if os.path.isdir(p):
+      w.add_dir(p)
+    else:
+      w.add_file(p)
+  try:
+    while True:
+      for p in sorted(w.wait()):
+        print('Changed: {}'.format(p))
+  except KeyboardInterrupt:
+    pass
+  w.close()
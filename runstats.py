@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+'''Run statistics
+
+## Description
+
+This module is used to count and time operations, for finding where
+time goes in a run.
+
+Functions are instrumented with `instrument`, which replaces them in
+their module namespace with a wrapper that counts calls and adds up
+elapsed time.  Nothing is instrumented until requested, so there is
+no overhead when statistics are disabled.  Other events are counted
+with `count`, which only has effect once `enable` was called.
+
+Statistics can be reported to `stderr` or appended as a JSON line to
+a file (See `report`).
+
+'''
+import os
+import sys
+import time
+import json
+
+enabled = False
+'''True if statistics are being collected'''
+counters = {}
+'''Collected statistics: `{ name: { 'count', 'time', 'depth', 'max_depth' } }`'''
+started = time.perf_counter()
+'''Start time of the run'''
+instrumented = set()
+'''Functions already instrumented, as `(namespace id, name)`'''
+
+def enable():
+  '''Enable collection of statistics'''
+  global enabled, started
+  enabled = True
+  started = time.perf_counter()
+
+def counter(name):
+  '''Get a counter, creating it if needed
+
+  :param str name: counter name
+  :returns dict: counter
+  '''
+  if not name in counters:
+    counters[name] = { 'count': 0, 'time': 0.0, 'depth': 0, 'max_depth': 0 }
+  return counters[name]
+
+def count(name, n = 1):
+  '''Count an event
+
+  :param str name: counter name
+  :param int n: (Optional) amount to add, defaults to 1
+  '''
+  if enabled: counter(name)['count'] += n
+
+def instrument(ns, fname, name = None):
+  '''Instrument a function
+
+  :param dict ns: namespace containing the function (i.e. `globals()` or `vars(module)`)
+  :param str fname: function name
+  :param str|None name: (Optional) counter name, defaults to `fname`
+
+  Calls are counted and timed.  For recursive functions, only the
+  outermost call is timed, and the maximum nesting depth is kept.
+  '''
+  key = (id(ns), fname)
+  if key in instrumented: return
+  instrumented.add(key)
+  fn = ns[fname]
+  cnt = counter(fname if name is None else name)
+
+  def wrapper(*args, **kwargs):
+    cnt['count'] += 1
+    cnt['depth'] += 1
+    if cnt['depth'] > cnt['max_depth']: cnt['max_depth'] = cnt['depth']
+    if cnt['depth'] > 1:
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        cnt['depth'] -= 1
+    start = time.perf_counter()
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      cnt['time'] += time.perf_counter() - start
+      cnt['depth'] -= 1
+
+  wrapper.__name__ = fn.__name__
+  wrapper.__doc__ = fn.__doc__
+  wrapper.__wrapped__ = fn
+  ns[fname] = wrapper
+
+def take():
+  '''Get the collected statistics and reset them
+
+  :returns dict: counts and times by name
+
+  Used to send statistics from worker processes to the parent
+  (See `merge`).
+  '''
+  res = {}
+  for name, cnt in counters.items():
+    if cnt['count'] == 0: continue
+    res[name] = { 'count': cnt['count'], 'time': cnt['time'], 'max_depth': cnt['max_depth'] }
+    cnt['count'] = 0
+    cnt['time'] = 0.0
+    cnt['max_depth'] = 0
+  return res
+
+def merge(stats):
+  '''Add statistics collected elsewhere
+
+  :param dict stats: statistics as returned by `take`
+  '''
+  for name, s in stats.items():
+    cnt = counter(name)
+    cnt['count'] += s['count']
+    cnt['time'] += s['time']
+    if s['max_depth'] > cnt['max_depth']: cnt['max_depth'] = s['max_depth']
+
+def summary(prog):
+  '''Create a statistics summary
+
+  :param str prog: program name
+  :returns dict: summary
+  '''
+  return {
+    'prog': prog,
+    'time': time.time(),
+    'cwd': os.getcwd(),
+    'elapsed': time.perf_counter() - started,
+    'counters': {
+      name: { 'count': cnt['count'], 'time': cnt['time'], 'max_depth': cnt['max_depth'] }
+      for name, cnt in sorted(counters.items()) if cnt['count'] > 0
+    },
+  }
+
+def report(prog, output = '-'):
+  '''Report statistics
+
+  :param str prog: program name
+  :param str output: (Optional) `-` for `stderr`, otherwise a file to append a JSON line to
+  '''
+  if not enabled: return
+  res = summary(prog)
+  if output != '-':
+    try:
+      with open(output,'a') as fp:
+        fp.write(json.dumps(res, sort_keys=True) + '\n')
+    except OSError as err:
+      sys.stderr.write('{file}: {err}\n'.format(file=output, err=str(err)))
+    return
+
+  sys.stderr.write('{prog} stats: elapsed {elapsed:.3f}s\n'.format(**res))
+  for name, cnt in res['counters'].items():
+    txt = '  {name:24} {count:10}'.format(name=name, count=cnt['count'])
+    if cnt['max_depth'] > 0:
+      txt += ' {time:9.3f}s'.format(time=cnt['time'])
+    if cnt['max_depth'] > 1:
+      txt += '  max depth {depth}'.format(depth=cnt['max_depth'])
+    sys.stderr.write(txt + '\n')
+
+def stats_output(opt, envvar):
+  '''Find where statistics should be reported
+
+  :param str|None opt: value of the `--stats` option
+  :param str envvar: environment variable name checked if `opt` is None
+  :returns str|None: `-` for `stderr`, a file name, or None if disabled
+
+  The environment variable may contain `1` or `-` for `stderr`,
+  a file name, or be empty to disable statistics.
+  '''
+  if opt is None: opt = os.getenv(envvar)
+  if opt is None or opt == '' or opt == '0': return None
+  if opt == '1': return '-'
+  return opt
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''Text file id resolver
+
+## Description
+
+This module is used to look-up the value of text file ids (e.g.
+`<%VERSION%>`).  A text file id refers to a file, whose first line
+is used as its value.
+
+Values are cached and only read again if the file modification
+time or size changes.  Values can also be defined directly in
+`defines` (used for the `ashdoc` `-D` command line option).
+
+'''
+import os
+
+id_cache = {}
+'''Cache of text file id values by file path'''
+defines = {}
+'''Text file id values used when no text file id file is found'''
+
+def read_id(idfile):
+  '''Read the value of a text file id
+
+  :param str idfile: text file id file
+  :returns str|None: the text file id value or None if `idfile` is not a readable file or is empty
+
+  Only the first line of the file is read.  Leading and trailing
+  white space is removed from it (which may leave an empty value).
+  If the file starts with an empty line, or has only one line without
+  a line terminator, its full contents are used as is.  An empty file
+  has no value, so the text file id is left as is.
+  '''
+  try:
+    st = os.stat(idfile)
+  except OSError:
+    return None
+  sig = (st.st_mtime_ns, st.st_size)
+  if idfile in id_cache and id_cache[idfile][0] == sig: return id_cache[idfile][1]
+
+  try:
+    with open(idfile,'r') as fp:
+      txid = fp.readline()
+      if txid == '\n':
+        txid += fp.read()
+      elif txid.endswith('\n'):
+        txid = txid[:-1].strip()
+      elif txid == '':
+        txid = None
+  except (OSError, UnicodeDecodeError):
+    return None
+  id_cache[idfile] = (sig, txid)
+  return txid
+
+def lookup(idpath, idfile = None):
+  '''Look-up a text file id
+
+  :param str idpath: text file id path (`.` replaced with `/`)
+  :param str|None idfile: (Optional) text file id file found for `idpath`
+  :returns str|None: the text file id value, or None if not found
+
+  Uses the contents of `idfile`, and falls back to the values in
+  `defines`.
+  '''
+  if not idfile is None:
+    txid = read_id(idfile)
+    if not txid is None: return txid
+  return defines.get(idpath)
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+
+  cli = ArgumentParser(prog='txtid', description='Text file id look-up')
+  cli.add_argument('-D','--define', help='Define text file id value', action='append')
+  cli.add_argument('id', help='Text file id files', nargs='+')
+  opts = cli.parse_args()
+
+  if not opts.define is None:
+    for d in opts.define:
+      k, v = d.split('=', 1) if '=' in d else (d, d)
+      defines[k] = v
+  for i in opts.id:
+    print('{id}: {value}'.format(id=i, value=lookup(i, i if os.path.isfile(i) else None)))